@@ -0,0 +1,130 @@
+# Measure how fast JS8CALL UDP messages are parsed.
+'''
+    Compares the old way of reading a message (json.loads, then
+    splitting TEXT and checking callsigns with re.match) against
+    js8parse.parse().  Run it from the JS8MAP directory:
+
+        python bench/bench_parse.py [file]
+
+    'file' holds recorded JS8CALL messages, one JSON object per
+    line.  Without it, a stream in the same form is made up from the
+    callsigns in callbook.dat, with the usual mix of heartbeats, SNR
+    reports, HEARING lists, directed messages and status reports.
+'''
+
+import os, sys
+import re
+import json
+import time
+import random
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname(
+  os.path.abspath(__file__) )))
+import js8parse
+
+EOT = '♢'
+
+def made_up( count=50000 ):
+  here = os.path.dirname( os.path.dirname( os.path.abspath(__file__) ))
+  calls = []
+  with open( os.path.join( here, 'callbook.dat' )) as f:
+    for d in f:
+      d = d.strip()
+      if d and d[0] != '#':
+        calls.append( d.split(',') )
+  calls = calls[:300]      # A busy band, not the whole callbook
+  random.seed( 1 )
+  msgs = []
+  for i in range(count):
+    (cfr, grid), (cto, g2) = random.sample( calls, 2 )
+    r = random.random()
+    if r < 0.35:
+      cmd, cto, text = ' HEARTBEAT', '@HB', grid
+    elif r < 0.55:
+      cmd, text = ' SNR', str(random.randint(-25, 10))
+    elif r < 0.65:
+      heard = ' '.join( c for c, g in random.sample( calls, 5 ))
+      cmd, text = ' HEARING', heard
+    elif r < 0.75:
+      cmd, text = ' ACK', ''
+    elif r < 0.85:
+      cmd, text = '', 'GM TNX FER CALL 73'
+    else:
+      msgs.append( json.dumps( {'type': 'STATION.STATUS', 'value': '',
+        'params': {'DIAL': 7078000, 'FREQ': 7079500, 'OFFSET': 1500,
+                   'SELECTED': '', 'SPEED': 0, '_ID': -1}} ).encode() )
+      continue
+    msgs.append( json.dumps( {'type': 'RX.DIRECTED',
+      'value': ' '.join( w for w in (cfr + ':', cto, cmd.strip(), text) if w ),
+      'params': {'CMD': cmd, 'DIAL': 7078000, 'EXTRA': '',
+                 'FREQ': 7079500, 'FROM': cfr, 'GRID': ' ' + grid,
+                 'OFFSET': random.randint(500, 2500),
+                 'SNR': random.randint(-25, 10), 'SPEED': 0,
+                 'TDRIFT': round(random.uniform(-1, 1), 1),
+                 'TEXT': ' '.join( w for w in (cfr + ':', cto, cmd.strip(),
+                                               text, EOT + ' ') if w ),
+                 'TO': cto, 'UTC': 1600000000000 + i, '_ID': -1}}
+      ).encode() )
+  return msgs
+
+# The way messages were read before js8parse.
+callpat = re.compile('^[0-9A-Z/]+$')
+
+def clean( c ):
+  if re.match( callpat, c ):
+    return c
+  return None
+
+def old_parse( msg ):
+  js8 = json.loads( msg.decode('utf-8') )['params']
+  if 'CMD' in js8:
+    c = js8['CMD'].strip()
+    tdrift = float(js8['TDRIFT'])
+    offset = int(js8['OFFSET'])
+    cfr = clean(js8['FROM'])
+    cto = clean(js8['TO'])
+    lvl = int(js8['SNR'])
+    txtlist = js8['TEXT'].strip().split(' ')[3:]
+    if len(txtlist) > 0:
+      txtlist.pop()
+    txt = ' '.join(txtlist)
+    if c == 'HEARING':
+      for w in txtlist:
+        clean(w)
+  elif 'DIAL' in js8:
+    mhz = int(js8['FREQ'] / 1000000)
+
+def new_parse( msg ):
+  ev = js8parse.parse( msg )
+  if ev.cmd == 'HEARING':
+    for w in ev.words:
+      js8parse.clean(w)
+
+def rate( func, msgs, rounds=5 ):
+  best = None
+  for r in range(rounds):
+    t = time.perf_counter()
+    for m in msgs:
+      func( m )
+    t = time.perf_counter() - t
+    if best is None or t < best:
+      best = t
+  return len(msgs) / best
+
+def main():
+  if len(sys.argv) > 1:
+    with open( sys.argv[1], 'rb' ) as f:
+      msgs = [line.strip() for line in f if line.strip()]
+    what = sys.argv[1]
+  else:
+    msgs = made_up()
+    what = 'made-up stream'
+  print("{} messages from {}".format(len(msgs), what))
+  old = rate( old_parse, msgs )
+  new = rate( new_parse, msgs )
+  print("  json.loads + re.match: {:>9,.0f} messages/s".format(old))
+  print("  js8parse ({:>7}):    {:>9,.0f} messages/s  ({:.2f}x)".format(
+    js8parse.backend, new, new / old))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,316 @@
+# Measure the whole path from UDP message to map drawing.
+'''
+    Feeds JS8CALL messages through js8ingest (do_cmd, setgrid,
+    sethears), lets the timers purge links and fade stations, and
+    repaints the map after each batch as the real program does.  The
+    map is drawn on a stand-in canvas that only counts items, so no
+    display is needed, but zooming and fitting the background map
+    (World.zoom and World.fit) do their real work.
+
+        python bench/bench_pipeline.py
+        python bench/bench_pipeline.py --sizes=100,1000 --events=5000
+        python bench/bench_pipeline.py --replay=capture.dat
+
+    Each size runs in its own process so that the peak memory
+    reported is for that size alone.  The report gives messages
+    handled per second, the median and 99th percentile time of a
+    repaint, and the peak resident memory.
+'''
+
+import os, sys
+import time
+import json
+import random
+import argparse
+import subprocess
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+here = os.path.dirname( os.path.dirname( os.path.abspath(__file__) ))
+sys.path.insert( 0, here )
+
+# Settings that would come from js8config.
+FLAGS = argparse.Namespace( debug=0, icon=False, map=0, map_cache=32,
+  prefetch=False, link_timeout=15, station_timeout=30, batch=100,
+  flush=60, capture=None, profile=None, lock=False, corners=None, tx=False, width=1000,
+  port=2242, ports=[2242], call=None, grid=None )
+
+#### Runs tkinter-style after() jobs when the benchmark says so.
+class StubWindow:
+
+  def __init__(self):
+    self.jobs = []
+    self.idle = []
+    self.n = 0
+
+  def after(self, ms, func, *args):
+    self.n += 1
+    self.jobs.append( (time.monotonic() + ms / 1000, self.n, func, args) )
+
+  def after_idle(self, func, *args):
+    self.idle.append( (func, args) )
+
+  # Run the jobs that are due.
+  def run_due(self):
+    now = time.monotonic()
+    due = [j for j in self.jobs if j[0] <= now]
+    if due:
+      self.jobs = [j for j in self.jobs if j[0] > now]
+      for when, n, func, args in sorted(due):
+        func( *args )
+
+  # Run what Tk would do when idle: the repaint.
+  def run_idle(self):
+    idle = self.idle
+    self.idle = []
+    for func, args in idle:
+      func( *args )
+
+#### A canvas that keeps track of items but draws nothing.
+class StubCanvas:
+
+  def __init__(self, window, width, height):
+    self.window = window
+    self.width = width
+    self.height = height
+    self.items = {}      # item: [type, coords, tags]
+    self.n = 0
+
+  def create(self, kind, coords, kw):
+    self.n += 1
+    tags = kw.get( 'tags', () )
+    if isinstance( tags, str ):
+      tags = (tags,)
+    self.items[self.n] = [kind, list(coords), tags]
+    return self.n
+
+  def create_text(self, *c, **kw):
+    return self.create( 'text', c, kw )
+
+  def create_oval(self, *c, **kw):
+    return self.create( 'oval', c, kw )
+
+  def create_line(self, *c, **kw):
+    return self.create( 'line', c, kw )
+
+  def create_rectangle(self, *c, **kw):
+    return self.create( 'rectangle', c, kw )
+
+  def create_image(self, *c, **kw):
+    return self.create( 'image', c, kw )
+
+  def delete(self, item):
+    if isinstance( item, str ):
+      for i in [i for i, v in self.items.items() if item in v[2]]:
+        del self.items[i]
+    else:
+      self.items.pop( item, None )
+
+  def coords(self, item, *c):
+    if c:
+      self.items[item][1] = list(c)
+    return self.items[item][1]
+
+  def move(self, item, dx, dy):
+    c = self.items[item][1]
+    c[0] += dx
+    c[1] += dy
+
+  def type(self, item):
+    return self.items[item][0]
+
+  def itemconfigure(self, item, **kw):
+    pass
+
+  def lower(self, item):
+    pass
+
+  def tag_raise(self, item):
+    pass
+
+  def bbox(self, item):
+    c = self.items[item][1]
+    return (c[0], c[1], c[0] + 100, c[1] + 20)
+
+  def winfo_width(self):
+    return self.width
+
+  def winfo_height(self):
+    return self.height
+
+  def after(self, ms, func, *args):
+    self.window.after( ms, func, *args )
+
+# Set up the drawing modules on the stand-in window and canvas.
+def setup( width=1000, height=600 ):
+  import js8draw as draw
+  import js8world as world
+  import js8station as sta
+  import js8ingest
+  import js8explore as explore
+
+  # Background map images are put on the canvas as they are.
+  world.ImageTk.PhotoImage = lambda image: image
+
+  window = StubWindow()
+  canvas = StubCanvas( window, width, height )
+  draw.window = window
+  draw.canvas = canvas
+  draw.FLAGS = FLAGS
+  draw.menuLockFlag = argparse.Namespace( get=lambda: False )
+  draw.callfont = draw.callfont2 = 'Arial 12 bold'
+  draw.resetTime = sta.datetime.datetime.now()
+  draw.swid = width
+  draw.shgt = height
+  world.MapSpec.load()
+  draw.worldmap = world.World( canvas, FLAGS )
+
+  # Wait for the background map to be cut into tiles.
+  while not draw.worldmap.tiles.loaded:
+    time.sleep( 0.05 )
+
+  explore.start( window, FLAGS )
+  sta.start( FLAGS, draw )
+  js8ingest.start( FLAGS, window, draw, None )
+  draw.setzoom( None )
+  return window, canvas
+
+letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+# Made-up traffic among 'n' stations spread over North America.
+# Each station first sends a heartbeat with its grid, then there
+# is a mix of heartbeats, SNR reports, HEARING lists, directed
+# messages and acknowledgements.
+def traffic( n, events ):
+  random.seed( n )
+  calls = set()
+  while len(calls) < n:
+    calls.add( '{}{}{}{}'.format( random.choice('KWNA'),
+      random.choice(letters), random.randint(0, 9),
+      ''.join( random.choices( letters, k=3 )) ))
+  calls = sorted(calls)
+  grids = {}
+  for c in calls:
+    lng = random.uniform( -124, -68 )
+    lat = random.uniform( 26, 49 )
+    grids[c] = '{}{}{}{}'.format( letters[int((lng + 180) / 20)],
+      letters[int((lat + 90) / 10)], int((lng + 180) % 20 / 2),
+      int((lat + 90) % 10) )
+
+  def msg( cfr, cto, cmd, text, grid='' ):
+    return json.dumps( {'type': 'RX.DIRECTED', 'params': {
+      'CMD': cmd, 'FROM': cfr, 'TO': cto, 'GRID': grid,
+      'SNR': random.randint(-25, 10), 'OFFSET': random.randint(500, 2500),
+      'TDRIFT': 0.2, 'FREQ': 7079500, 'DIAL': 7078000,
+      'TEXT': ' '.join( w for w in (cfr + ':', cto, cmd.strip(), text, '♢ ')
+                        if w )}}).encode()
+
+  msgs = [msg( c, '@HB', ' HEARTBEAT', grids[c], ' ' + grids[c] )
+          for c in calls]
+  for i in range(events):
+    cfr, cto = random.sample( calls, 2 )
+    r = random.random()
+    if r < 0.3:
+      msgs.append( msg( cfr, '@HB', ' HEARTBEAT', grids[cfr],
+                        ' ' + grids[cfr] ))
+    elif r < 0.55:
+      msgs.append( msg( cfr, cto, ' SNR', '-5' ))
+    elif r < 0.7:
+      heard = ' '.join( random.sample( calls, min(n, 6) ))
+      msgs.append( msg( cfr, cto, ' HEARING', heard ))
+    elif r < 0.85:
+      msgs.append( msg( cfr, cto, '', 'GM TNX FER CALL 73' ))
+    else:
+      msgs.append( msg( cfr, cto, ' ACK', '' ))
+  return msgs
+
+# Run one size and report it as a line of JSON.
+def run_one( n, events, replay ):
+  import js8ingest
+  import js8station as sta
+  import js8draw as draw
+  from js8grid import grid2coord
+
+  window, canvas = setup()
+  # Short timeouts, so that links and stations expire during the run.
+  sta.link_timeout = 2
+  sta.station_timeout = 3
+
+  if replay:
+    import js8capture
+    msgs = [m for when, port, m in js8capture.read( replay )]
+  else:
+    msgs = traffic( n, events )
+
+  src = js8ingest.Source( FLAGS.port, None )
+  repaints = []
+  began = time.perf_counter()
+  for i in range( 0, len(msgs), FLAGS.batch ):
+    for m in msgs[i:i + FLAGS.batch]:
+      js8ingest.take( m, src )
+    window.run_due()
+    # Pan now and then, which makes the map zoom and fit again.
+    if (i // FLAGS.batch) % 50 == 49:
+      draw.pan( random.choice( (-10, 10) ), 0, 0 )
+      draw.needupdate( 'pan' )
+    t = time.perf_counter()
+    window.run_idle()
+    repaints.append( time.perf_counter() - t )
+  took = time.perf_counter() - began
+
+  # grid2coord on its own, as setgrid uses it.
+  t = time.perf_counter()
+  for i in range(100000):
+    grid2coord( 'FN42' )
+  g2c = 100000 / (time.perf_counter() - t)
+
+  repaints.sort()
+  rss = None
+  if resource:
+    rss = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+    if sys.platform == 'darwin':
+      rss //= 1024
+  print( json.dumps( {
+    'stations': len(sta.Station.book), 'messages': len(msgs),
+    'processed': js8ingest.processed, 'rate': len(msgs) / took,
+    'p50': repaints[len(repaints) // 2] * 1000,
+    'p99': repaints[min(len(repaints) - 1, int(len(repaints) * 0.99))] * 1000,
+    'items': len(canvas.items), 'rss': rss, 'grid2coord': g2c } ))
+
+def main():
+  p = argparse.ArgumentParser()
+  p.add_argument( '--sizes', default='100,1000,10000',
+    help='Numbers of stations, separated by commas' )
+  p.add_argument( '--events', type=int, default=20000,
+    help='Messages after the first heartbeat from each station' )
+  p.add_argument( '--replay', default=None,
+    help='Capture file to use instead of made-up traffic' )
+  p.add_argument( '--one', type=int, default=None, help=argparse.SUPPRESS )
+  args = p.parse_args()
+
+  if args.one is not None:
+    run_one( args.one, args.events, args.replay )
+    return
+
+  sizes = [int(n) for n in args.sizes.split(',')]
+  if args.replay:
+    sizes = [0]
+  print("{:>8} {:>8} {:>10} {:>9} {:>9} {:>8} {:>12}".format( 'stations',
+    'messages', 'msgs/s', 'p50 ms', 'p99 ms', 'RSS MB', 'grid2coord/s' ))
+  for n in sizes:
+    cmd = [sys.executable, os.path.abspath(__file__), '--one', str(n),
+           '--events', str(args.events)]
+    if args.replay:
+      cmd += ['--replay', args.replay]
+    out = subprocess.run( cmd, stdout=subprocess.PIPE, check=True,
+                          universal_newlines=True ).stdout
+    r = json.loads( out.strip().splitlines()[-1] )
+    print("{:>8} {:>8} {:>10,.0f} {:>9.2f} {:>9.2f} {:>8} {:>12,.0f}".format(
+      r['stations'], r['messages'], r['rate'], r['p50'], r['p99'],
+      '-' if r['rss'] is None else r['rss'] // 1024, r['grid2coord'] ))
+
+if __name__ == '__main__':
+  main()
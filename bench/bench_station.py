@@ -0,0 +1,61 @@
+# Measure the memory used by Station objects.
+'''
+    Creates a network of stations the way HEARING messages do, with
+    each station hearing a handful of others, and reports the memory
+    used per station.  Run it from the JS8MAP directory:
+
+        python bench/bench_station.py [count ...]
+
+    The default is 10000 and 100000 stations.
+'''
+
+import os, sys
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname(
+  os.path.abspath(__file__) )))
+import js8station as sta
+
+# Settings that Station needs, without reading js8map.ini.
+FLAGS = argparse.Namespace( debug=0, link_timeout=15, station_timeout=30 )
+
+def calls( n ):
+  random.seed( n )
+  made = set()
+  while len(made) < n:
+    made.add( '{}{}{}{}'.format( random.choice('KWNAV'),
+      random.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ'), random.randint(0,9),
+      ''.join(random.choices('ABCDEFGHIJKLMNOPQRSTUVWXYZ', k=3)) ))
+  return sorted(made)
+
+def grid():
+  return '{}{}{}{}'.format( random.choice('ABCDEFGHIJKLMNOPQR'),
+    random.choice('ABCDEFGHIJKLMNOPQR'), random.randint(0,9),
+    random.randint(0,9) )
+
+def measure( n, hearing=5 ):
+  names = calls( n )
+  sta.Station.reset()
+  tracemalloc.start()
+  before = tracemalloc.get_traced_memory()[0]
+  for c in names:
+    s = sta.gotStation( c )
+    s.setgrid( grid(), saveit=0 )
+    s.sethears( random.sample( names, hearing ))
+  used = tracemalloc.get_traced_memory()[0] - before
+  tracemalloc.stop()
+  sta.Station.reset()
+  return used
+
+def main():
+  sta.start( FLAGS )
+  counts = [int(n) for n in sys.argv[1:]] or [10000, 100000]
+  for n in counts:
+    used = measure( n )
+    print("{:>8} stations: {:>6.1f} MB, {:>5} bytes per station".format(
+      n, used / 1e6, used // n ))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,246 @@
+# JS8CALLBOOK: Remember station locations between sessions
+'''
+    This module is part of JS8MAP.  It keeps the callbook, the grid
+    location of every station ever heard, in an SQLite database so
+    that a big callbook does not have to be read in at startup.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import os
+import time
+import mmap
+import struct
+import sqlite3
+import js8stats as stats
+
+# A reference callbook file starts with a header giving its record
+# count, followed by fixed-size records sorted by callsign.
+REFMAGIC = b'JS8REF01'
+REFHEADER = struct.Struct( '<8sI' )
+REFRECORD = struct.Struct( '<16s4sI' )     # call, grid, time
+
+#### This class is a read-only callbook of a large number of
+#### stations, such as a national callsign database.  The file is
+#### memory mapped and searched in place, so it takes no time to
+#### open and no memory beyond what the system caches.
+class RefBook:
+
+  def __init__(self, fname):
+    self.fname = fname
+    self.count = 0
+    self.mm = None
+    with open( fname, "rb" ) as f:
+      head = f.read( REFHEADER.size )
+      if len(head) < REFHEADER.size:
+        print("Reference callbook {} is empty".format(fname))
+        return
+      magic, count = REFHEADER.unpack( head )
+      if magic != REFMAGIC:
+        print("{} is not a reference callbook".format(fname))
+        return
+      self.count = count
+      if count:
+        self.mm = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+
+  # Binary search for a callsign.  Returns the (grid, time) pair or
+  # None if the call is not in the book.
+  def find(self, call):
+    if not self.mm:
+      return None
+    key = call.encode( 'ascii', 'replace' )[:16].ljust( 16, b'\0' )
+    mm = self.mm
+    rs = REFRECORD.size
+    lo = 0
+    hi = self.count
+    while lo < hi:
+      mid = (lo + hi) // 2
+      at = REFHEADER.size + mid * rs
+      c = mm[at:at+16]
+      if c < key:
+        lo = mid + 1
+      elif c > key:
+        hi = mid
+      else:
+        c, g, t = REFRECORD.unpack_from( mm, at )
+        return (g.decode('ascii'), t)
+    return None
+
+  # Every (call, grid, time) entry, in callsign order.
+  def entries(self):
+    for i in range(self.count):
+      c, g, t = REFRECORD.unpack_from( self.mm, \
+        REFHEADER.size + i * REFRECORD.size )
+      yield (c.rstrip(b'\0').decode('ascii'), g.decode('ascii'), t)
+
+  def __len__(self):
+    return self.count
+
+  def close(self):
+    if self.mm:
+      self.mm.close()
+      self.mm = None
+
+  # Write a reference callbook from (call, grid, time) entries,
+  # which must already be sorted by call with no duplicates.  The
+  # file is written under a temporary name and then renamed, so a
+  # reader never sees half of it.
+  @classmethod
+  def write( self, fname, entries ):
+    tmp = fname + '.tmp'
+    count = 0
+    try:
+      with open( tmp, "wb" ) as f:
+        f.write( REFHEADER.pack( REFMAGIC, 0 ))
+        for c, g, t in entries:
+          f.write( REFRECORD.pack( c.encode('ascii', 'replace'), \
+                                   g.encode('ascii', 'replace'), int(t) ))
+          count += 1
+        f.seek( 0 )
+        f.write( REFHEADER.pack( REFMAGIC, count ))
+    except BaseException:
+      os.remove( tmp )
+      raise
+    os.replace( tmp, fname )
+    return count
+
+#### This class looks like a dictionary of grids indexed by
+#### callsign, but the entries live in a database file.  Each
+#### station has one entry, which is updated when it moves.
+#### Changes are held in memory and written together by flush(),
+#### so a flood of new stations does not mean a disk write for
+#### each one.  Each flush is a single transaction, so a crash
+#### leaves the file as it was after the previous flush.
+#### Stations not in the database are looked up in the reference
+#### callbook, if there is one.
+class Callbook:
+
+  def __init__(self, fname, reffile=None):
+    self.fname = fname
+    self.pending = {}      # call: (grid, time), or None to delete
+    self.ref = None
+    if reffile and os.path.isfile( reffile ):
+      self.ref = RefBook( reffile )
+    self.db = sqlite3.connect( fname )
+    self.db.execute( 'PRAGMA journal_mode=WAL' )
+    self.db.execute( 'PRAGMA synchronous=NORMAL' )
+    self.db.execute( 'CREATE TABLE IF NOT EXISTS calls ('
+                     ' call TEXT PRIMARY KEY,'
+                     ' grid TEXT NOT NULL,'
+                     ' updated REAL NOT NULL ) WITHOUT ROWID' )
+    self.db.execute( 'CREATE TABLE IF NOT EXISTS meta ('
+                     ' key TEXT PRIMARY KEY, value TEXT )' )
+    self.db.commit()
+
+  @stats.timed( 'callbook get' )
+  def get(self, call, default=None):
+    if call in self.pending:
+      p = self.pending[call]
+      if p:
+        return p[0]
+      return default
+    row = self.db.execute( 'SELECT grid FROM calls WHERE call = ?',
+                           (call,) ).fetchone()
+    if row:
+      return row[0]
+    if self.ref:
+      r = self.ref.find( call )
+      if r:
+        return r[0]
+    return default
+
+  def __contains__(self, call):
+    return self.get( call ) is not None
+
+  def __getitem__(self, call):
+    g = self.get( call )
+    if g is None:
+      raise KeyError( call )
+    return g
+
+  def __setitem__(self, call, grid):
+    self.pending[call] = (grid, time.time())
+
+  def __delitem__(self, call):
+    if call not in self:
+      raise KeyError( call )
+    self.pending[call] = None
+
+  # The number of stations in the database and reference callbook.
+  # Some may be in both.
+  def __len__(self):
+    self.flush()
+    return self.saved()
+
+  # The same, leaving out changes not yet written.
+  def saved(self):
+    n = self.db.execute( 'SELECT COUNT(*) FROM calls' ).fetchone()[0]
+    if self.ref:
+      n += len(self.ref)
+    return n
+
+  # Write all the waiting changes.  Returns how many there were.
+  @stats.timed( 'callbook flush' )
+  def flush(self):
+    if not self.pending:
+      return 0
+    n = len(self.pending)
+    with self.db:
+      self.db.executemany( 'INSERT OR REPLACE INTO calls VALUES (?, ?, ?)',
+        [(c, p[0], p[1]) for c, p in self.pending.items() if p] )
+      self.db.executemany( 'DELETE FROM calls WHERE call = ?',
+        [(c,) for c, p in self.pending.items() if not p] )
+    self.pending = {}
+    return n
+
+  def close(self):
+    self.flush()
+    self.db.close()
+    if self.ref:
+      self.ref.close()
+
+  # Bring in entries from a text callbook, with a callsign and grid
+  # on each line.  The first time, later lines replace earlier ones
+  # because older versions of JS8MAP appended a new line when a
+  # station moved.  After that, the file is only read again if it
+  # has been edited, and then only to add stations we do not know.
+  @stats.timed( 'callbook migrate' )
+  def migrate(self, textfile):
+    if not os.path.isfile( textfile ):
+      return 0
+    self.flush()
+    mtime = str( os.path.getmtime( textfile ))
+    row = self.db.execute( "SELECT value FROM meta WHERE key = 'imported'"
+                           ).fetchone()
+    if row and row[0] == mtime:
+      return 0
+    if row:
+      sql = 'INSERT OR IGNORE INTO calls VALUES (?, ?, ?)'
+    else:
+      sql = 'INSERT OR REPLACE INTO calls VALUES (?, ?, ?)'
+
+    when = os.path.getmtime( textfile )
+    count = 0
+    with open( textfile, "r" ) as f:
+      for d in f:
+        d = d.strip()
+        # Ignore empty and comment lines.
+        if d != '' and d[0] != '#':
+          (c,g) = d.split(',')
+          self.db.execute( sql, (c.strip(), g.strip(), when) )
+          count += 1
+    self.db.execute( "INSERT OR REPLACE INTO meta VALUES ('imported', ?)",
+                     (mtime,) )
+    self.db.commit()
+    return count
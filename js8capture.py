@@ -0,0 +1,70 @@
+# JS8CAPTURE: Record UDP messages from JS8CALL
+'''
+    This module is part of JS8MAP.  It writes every UDP message from
+    JS8CALL to a file, with the time it arrived and the port it came
+    to, so that a busy evening on the air can be played back later
+    with js8replay.py.
+
+    The file starts with an eight byte marker.  Each message follows
+    as a header giving the time, port and length, then the message
+    exactly as it was received.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import time
+import struct
+
+MAGIC = b'JS8CAP01'
+HEADER = struct.Struct( '<dHH' )     # time, port, length
+
+#### A capture file being written.
+class Writer:
+
+  def __init__(self, fname):
+    self.fname = fname
+    self.count = 0
+    self.f = open( fname, "wb" )
+    self.f.write( MAGIC )
+
+  def write(self, msg, port, when=None):
+    if when is None:
+      when = time.time()
+    self.f.write( HEADER.pack( when, port, len(msg) ))
+    self.f.write( msg )
+    self.count += 1
+
+  def flush(self):
+    self.f.flush()
+
+  def close(self):
+    if not self.f.closed:
+      self.f.close()
+
+# Read a capture file.  Yields (time, port, message) for each
+# message.  A message cut short at the end, as when JS8MAP was
+# killed, is left out.
+def read( fname ):
+  with open( fname, "rb" ) as f:
+    if f.read( len(MAGIC) ) != MAGIC:
+      raise ValueError( "{} is not a JS8MAP capture file".format(fname) )
+    while True:
+      head = f.read( HEADER.size )
+      if len(head) < HEADER.size:
+        return
+      when, port, length = HEADER.unpack( head )
+      msg = f.read( length )
+      if len(msg) < length:
+        return
+      yield (when, port, msg)
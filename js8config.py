@@ -55,7 +55,13 @@ def start():
     p.add_argument( '--lock', action='store_true', \
                      default=FLAGS.lock)
     p.add_argument( '--data', default=FLAGS.data,
-                    help='File to save information')
+                    help='Text callbook to read station locations from')
+    p.add_argument( '--book', default=FLAGS.book,
+                    help='Database to save station locations')
+    p.add_argument( '--reference', default=FLAGS.reference,
+                    help='Large read-only callbook of station locations')
+    p.add_argument( '--flush', type=int, default=60,
+      help='Seconds between callbook saves')
     p.add_argument( '--corners', default=FLAGS.corners )
     p.add_argument( '--link_timeout', type=int, default=15,
       help="Minutes until links fade")
@@ -63,15 +69,40 @@ def start():
       help="Minutes until stations turn blue")
     p.add_argument( '--map', type=int, default=FLAGS.map,
       help='Map file selector')
-    p.add_argument( '--port', type=int, default=FLAGS.port,
-      help='UDP port from JS8CALL')
+    p.add_argument( '--map_cache', type=int, default=32,
+      help='Megabytes of fitted map images to keep')
+    p.add_argument( '--prefetch', action='store_true', default=False,
+      help='Prepare all background maps at startup')
+    p.add_argument( '--port', default=FLAGS.port,
+      help='UDP ports from JS8CALL, separated by commas')
+    p.add_argument( '--batch', type=int, default=100,
+      help='Most UDP messages to process per check')
+    p.add_argument( '--ingest', default='event', \
+                    choices=['event', 'thread', 'poll'], \
+                    help='How to wait for UDP messages')
+    p.add_argument( '--capture', default=None,
+      help='File to record every UDP message in')
+    p.add_argument( '--profile', default=None,
+      help='File to write cProfile statistics to')
+    p.add_argument( '--metrics_port', type=int, default=0,
+      help='Local HTTP port to serve Prometheus metrics on')
+    p.add_argument( '--headless', action='store_true', default=False,
+      help='Collect station data without displaying a map')
     p.add_argument( '--tx', action='store_true', default=FLAGS.tx,
       help='Enable exploratory transmission')
     p.add_argument( '--icon', action='store_true', \
                     default=FLAGS.icon, \
                     help='Display stations as icons')
+    p.add_argument( 'command', nargs='?', default='map', \
+                    choices=['map', 'import'], \
+                    help='Show the map, or import station locations')
+    p.add_argument( 'files', nargs='*', \
+                    help='CSV or ADIF files to import')
 
     FLAGS, unparsed = p.parse_known_args()
+
+    # Several JS8CALL instances can report to different ports.
+    FLAGS.ports = [int(n) for n in str(FLAGS.port).split(',')]
     return FLAGS
 
 # Load options from an INI-formated file.
@@ -90,6 +121,8 @@ def load( fname ):
 
     srcpath = os.path.abspath(__file__)
     cbpath = os.path.dirname(srcpath) + "/callbook.dat"
+    dbpath = os.path.dirname(srcpath) + "/callbook.db"
+    refpath = os.path.dirname(srcpath) + "/callbook.ref"
 
     # If a section exists we can read it.  Otherwise we just
     # set the defaults.
@@ -98,10 +131,14 @@ def load( fname ):
         FLAGS.call = s.get('call', None)
         FLAGS.grid = s.get('grid', None)
         FLAGS.data = s.get('data', cbpath)
+        FLAGS.book = s.get('book', dbpath)
+        FLAGS.reference = s.get('reference', refpath)
     else:
         FLAGS.call = None
         FLAGS.grid = None
         FLAGS.data = cbpath
+        FLAGS.book = dbpath
+        FLAGS.reference = refpath
         
     if 'JS8CALL' in c:
         j = c['JS8CALL']
@@ -23,9 +23,15 @@ from tkinter import font
 import js8station as sta
 import js8explore as explore
 import js8world as world
+import js8stats as stats
+import js8rate
+import js8waterfall
+from js8grid import grid2coord
 import datetime
+import time
 
 update_needed = False
+window = None
 canvas = None
 menuLockFlag = None
 congestion = 0
@@ -37,6 +43,27 @@ gamut = 0
 resetTime = None
 showHistory = False
 infoBox = None
+dirty = set()        # Stations that have changed since the last repaint
+linkshown = {}       # (from, to) stations: [canvas line, expiry time]
+actions = {}         # Station: expiry time of its action circle
+action_time = 14     # Seconds that lines and circles stay up
+sweep_interval = 2000  # Milliseconds between expiry sweeps
+fullredraw = True    # Everything must be drawn again
+showHover = False    # Show station info when the mouse is over it
+hovered = None       # Station whose info is showing because of hovering
+cellsize = 40        # Pixels on a side of each spatial index cell
+spatial = {}         # (column, row) cell: set of stations drawn in it
+indexed = {}         # Station: the cell it is indexed in
+showWaterfall = False  # Show the band activity panel
+waterfallImage = None  # Image in the panel, kept for as long as it shows
+waterfall_interval = 5000  # Milliseconds between panel updates
+waterfall_scale = 3    # Pixels on a side of each cell in the panel
+
+# Colors of the band activity panel: empty, then more messages, then
+# more messages with a strong signal among them.
+waterfall_palette = [ 24, 24, 48,
+   0, 64, 160,   0, 128, 224,   0, 200, 255,  160, 255, 255,
+ 160, 96, 0,   224, 128, 0,   255, 64, 0,   255, 0, 0 ]
 
 # We want the map to resize when the user stretches the main window.
 class ResizingCanvas(Canvas):
@@ -47,6 +74,7 @@ class ResizingCanvas(Canvas):
     Canvas.__init__(self,parent,**kwargs)
     self.bind("<Configure>", self.on_resize)
     self.bind("<Button-1>", self.on_click)
+    self.bind("<Motion>", self.on_motion)
     self.height = self.winfo_reqheight()
     self.width = self.winfo_reqwidth()
 
@@ -59,23 +87,38 @@ class ResizingCanvas(Canvas):
     cropneeded = True
     needupdate('resize')
     repaint()
+    drawWaterfall()
 
   # Respond to mouse clicks on the map.  If the click is close
   # enough to a station, we show what we know about it.
   def on_click(self, event):
     global infoBox, canvas
+    global hovered
     # Remove any existing info first.
     canvas.delete( 'info' )
+    hovered = None
 
     # Find the station we clicked on.
-    for s in sta.Station.book.values():
-      if abs( event.x - s.x ) < 20 and \
-         abs( event.y - s.y ) < 10:
-        drawStationInfo(s)
-        return
+    s = findStation( event.x, event.y )
+    if s:
+      drawStationInfo(s)
+      return
 
     # Nothing clicked on.  Remove any existing text.
 
+  # With hovering turned on, show information about whatever
+  # station the mouse is over.
+  def on_motion(self, event):
+    global hovered, canvas, showHover
+    if not showHover:
+      return
+    s = findStation( event.x, event.y )
+    if s is not hovered:
+      canvas.delete( 'info' )
+      hovered = s
+      if s:
+        drawStationInfo(s)
+
 # Intialize the drawing context within the provided application window.
 def start( w, f, lockFlag ):
   global window, canvas, callfont, logofont, logo, shgt, swid, FLAGS
@@ -105,6 +148,8 @@ def start( w, f, lockFlag ):
   world.MapSpec.load()
   
   worldmap = world.World( canvas, FLAGS )
+  if FLAGS.prefetch:
+    world.prefetch()
 
   # We flash a temporary logo and version for 3 seconds.
   flash_message( "JS8MAP\nVersion 0.7" )
@@ -112,6 +157,12 @@ def start( w, f, lockFlag ):
   # Update clock once per minute
   window.after( 60000, clock_tick )
 
+  # Remove expired lines and circles
+  window.after( sweep_interval, sweep )
+
+  # Keep the band activity panel up to date
+  window.after( waterfall_interval, waterfall_tick )
+
 def flash_message( msg ):
   global logo, logofont, canvas
   logo = canvas.create_text(int(swid/2), int(shgt/2), \
@@ -122,8 +173,10 @@ def flash_message( msg ):
 def setmap( self, mnum ):
   worldmap.setmap( mnum )
 
+# The session duration is shown in minutes.  Stations change
+# color by themselves when they fade.
 def clock_tick():
-  needupdate()
+  needupdate( 'clock' )
   window.after( 60000, clock_tick )
 
 ########## Convert Grid coordinates ############
@@ -141,7 +194,7 @@ def dump(x):
   global shgt, swid
   for s in sta.Station.book.values():
     print("  {} at {} detected {} state {} with {} links".format(
-      s.call,s.grid,s.reported,s.state, len(s.links)))
+      s.call,s.grid,s.reported,s.state, len(s.linked())))
 
 # Fit a bounding box around all observed stations.  This has
 # the effect of zooming the map to enclose those stations.
@@ -168,20 +221,6 @@ def setbound(x,y, observeLock=True):
     cropneeded = True
     oldcrop = newcrop
 
-# Convert grid name to longitude and latitude degrees.
-# Cells go A-R for 360 degrees or 20 deg per major cell in
-# longitude, and A-R for 180 degrees in latitude.
-# So cells are twice as wide as they are tall.
-def grid2coord(g):
-  if len(g) < 4:
-    print("Bad grid '{}'".format(g))
-    return (-90,40)
-
-  lng = ((ord(g[0]) - ord('A')) * 10 + (ord(g[2]) - ord('0'))) * 2 - 180+1
-  lat = ((ord(g[1]) - ord('A')) * 10 + (ord(g[3]) - ord('0'))) - 90
-  
-  return (lng, lat)
-
 ########## Drawing the map ############
 
 # Get screen coordinates for a station.  tkinter puts origin
@@ -200,21 +239,34 @@ def screen_coordinates(s):
 def clearHistory( s=None ):
   global canvas
   if s:
-    for line in s.hearshown.values():
-      canvas.delete( line )
-    s.hearshown = {}
+    if s.hearshown:
+      for line in s.hearshown.values():
+        canvas.delete( line )
+    s.hearshown = None
   else:
     for s2 in sta.Station.book.values():
       clearHistory(s2)
 
+# Remove the history lines drawn to any of a set of station IDs,
+# which are about to be given to other stations.
+def clearHeard( sids ):
+  global canvas
+  for s in sta.Station.book.values():
+    if s.hearshown:
+      for sid in sids & s.hearshown.keys():
+        canvas.delete( s.hearshown.pop( sid ))
+
 # Draw links to all heard by this station at any time during
 # this session.
 def drawhears( sfr ):
   global gamut
   if not sfr:
     return
-  if len(sfr.hears) == 0:
+  heard = sfr.hearing()
+  if len(heard) == 0:
     return
+  if sfr.hearshown is None:
+    sfr.hearshown = {}
 
   linecolor = ['grey64', 'grey48'][gamut]
 
@@ -222,21 +274,23 @@ def drawhears( sfr ):
   x1, y1 = screen_coordinates(sfr)
 
   # Draw a faint line each other station.
-  for other in sfr.hears.values():
+  for other in heard:
     # Get location for each heard station.
     x2, y2 = screen_coordinates(other)
     if x1 and x2:
       # We know its location.  If we already drew a line,
       # delete it in case it moved.
-      if other.call in sfr.hearshown:
-        gfx = sfr.hearshown[ other.call ]
+      if other.id in sfr.hearshown:
+        gfx = sfr.hearshown[ other.id ]
         canvas.delete(gfx)
       # Draw the line from 'sfr' to 'other'
       gfx = canvas.create_line( x1, y1, x2, y2, fill=linecolor )
-      sfr.hearshown[ other.call ] = gfx
+      sfr.hearshown[ other.id ] = gfx
 
 # Draw the line between two communicating stations.  This line is
-# temporary and represent something happening right now.
+# temporary and represent something happening right now.  There is
+# at most one line for each pair of stations; a new exchange just
+# moves it and keeps it around longer.
 def drawlink( sfr, sto ):
   global canvas
   if not sfr:
@@ -256,27 +310,67 @@ def drawlink( sfr, sto ):
   x1, y1 = screen_coordinates(sfr)
   x2, y2 = screen_coordinates(sto)
   if x1 and x2:
-    setAction( sfr, canvas.create_line( x1, y1, x2, y2, fill='wheat1' ))
+    expires = time.monotonic() + action_time
+    shown = linkshown.get( (sfr, sto) )
+    if shown:
+      canvas.coords( shown[0], x1, y1, x2, y2 )
+      shown[1] = expires
+    else:
+      linkshown[ (sfr, sto) ] = \
+        [canvas.create_line( x1, y1, x2, y2, fill='wheat1' ), expires]
+    needupdate()
 
 # Add an action indication to a station that will be removed in
 # one JS8 cycle.
 def setAction( s, a ):
-  global window
-  removeAction( s )
+  if s.action:
+    canvas.delete( s.action )
   s.action = a
-  window.after( 14000, removeAction, s )
+  actions[s] = time.monotonic() + action_time
   needupdate()
 
-# Remove the notation of a station action.
+# Remove the notation of a station action, and any lines
+# to or from it.
 def removeAction( s ):
   global canvas
   if s.action:
     canvas.delete( s.action )
     s.action = None
     needupdate('action')
+  actions.pop( s, None )
+  for pair in [pair for pair in linkshown if s in pair]:
+    canvas.delete( linkshown.pop(pair)[0] )
+    needupdate('action')
+
+# Remove all the actions and lines that have expired.  This runs
+# a few times per JS8 cycle rather than scheduling a removal for
+# each one.
+def sweep():
+  global window
+  now = time.monotonic()
+  for pair in [pair for pair, shown in linkshown.items() if shown[1] <= now]:
+    canvas.delete( linkshown.pop(pair)[0] )
+    needupdate('link expired')
+  for s in [s for s, expires in actions.items() if expires <= now]:
+    del actions[s]
+    if s.action:
+      canvas.delete( s.action )
+      s.action = None
+    needupdate('action expired')
+  window.after( sweep_interval, sweep )
+
+# When the map moves, so must the lines and action circles.
+def moveActions():
+  for (sfr, sto), shown in linkshown.items():
+    canvas.coords( shown[0], sfr.x, sfr.y, sto.x, sto.y )
+  for s in actions:
+    if s.action:
+      canvas.coords( s.action, s.x-20, s.y-20, s.x+20, s.y+20 )
 
 def removeStation( s ):
   global canvas
+  dirty.discard( s )
+  unplaceStation( s )
   if s.icon:
     canvas.delete( s.icon )
     s.icon = None
@@ -296,6 +390,50 @@ def actHB( s ):
     setAction( s, canvas.create_oval( x-20, y-20, x+20, y+20,
             width=3, outline='pink'))
 
+########## Finding stations on the screen ############
+# Stations are indexed by screen position in a grid of cells so
+# that finding the one under the mouse does not mean looking at
+# every station.  The index follows the stations as they are drawn.
+
+# Put a station in the cell for its screen position.
+def placeStation( s ):
+  if s.x is None:
+    unplaceStation( s )
+    return
+  cell = (s.x // cellsize, s.y // cellsize)
+  old = indexed.get( s )
+  if old == cell:
+    return
+  if old:
+    spatial[old].discard( s )
+  spatial.setdefault( cell, set() ).add( s )
+  indexed[s] = cell
+
+def unplaceStation( s ):
+  old = indexed.pop( s, None )
+  if old:
+    spatial[old].discard( s )
+
+# Find the station closest to a screen position, if any is close
+# enough.  A callsign is wider than it is tall so we allow more
+# room sideways.
+def findStation( x, y ):
+  best = None
+  bestdist = None
+  cx = x // cellsize
+  cy = y // cellsize
+  for col in (cx-1, cx, cx+1):
+    for row in (cy-1, cy, cy+1):
+      for s in spatial.get( (col, row), () ):
+        dx = abs( x - s.x )
+        dy = abs( y - s.y )
+        if dx < 20 and dy < 10:
+          dist = dx*dx + 4*dy*dy
+          if best is None or dist < bestdist:
+            best = s
+            bestdist = dist
+  return best
+
 # Draw a JS8 station on the map.  It can be shown as the callsign
 # or as a colored dot.
 def drawstation( s, doingcrop=False ):
@@ -308,6 +446,7 @@ def drawstation( s, doingcrop=False ):
   s.x, s.y = screen_coordinates( s )
   if FLAGS.debug > 4:
     print("Plot {} at {}, {}".format( s.call, s.x, s.y ))
+  placeStation( s )
 
   # If style of icon changes, we may need to recreate it.
   if s.icon:
@@ -351,7 +490,7 @@ def drawstation( s, doingcrop=False ):
   if showHistory:
     drawhears( s )
 
-    s.changed = False
+  s.changed = False
 
 # Draw a text box with various information about one station.
 def drawStationInfo(s):
@@ -362,9 +501,10 @@ def drawStationInfo(s):
   if s.heard:
     age = int((datetime.datetime.now() - s.heard).seconds/60)
     rpt += '\nLast heard {} min ago'.format(age)
-  names = []
-  for ocall in s.hears:
-    names.append( ocall )
+  rate = js8rate.station( s.id )
+  if rate:
+    rpt += '\nSending {:.0f} messages/hour'.format(rate)
+  names = [other.call for other in s.hearing()]
   if len(names) > 0:
     rpt += "\nHears {}".format(' '.join(names))
   if s.info:
@@ -381,20 +521,68 @@ def drawStationInfo(s):
   # Then move the text in front of the box.
   canvas.tag_raise( infoBox )
 
+# Draw the band activity panel in the lower left corner.  It shows
+# the messages heard at each offset, newest at the top, and lists
+# the quietest offsets below.
+def drawWaterfall():
+  global canvas, waterfallImage, showWaterfall, gamut, callfont, shgt
+  canvas.delete( 'waterfall' )
+  waterfallImage = None
+  if not showWaterfall:
+    return
+  wf = js8waterfall
+  img = Image.frombytes( 'P', (wf.cols, wf.rows), wf.activity.image() )
+  img.putpalette( waterfall_palette )
+  w = wf.cols * waterfall_scale
+  h = wf.rows * waterfall_scale
+  waterfallImage = ImageTk.PhotoImage( img.resize( (w, h), Image.NEAREST ))
+
+  fg = ['yellow','black'][gamut]
+  x = 10
+  y = shgt - h - 30
+  canvas.create_text( x, y - 4, anchor=tk.SW, fill=fg, font=callfont, \
+    text="Last {} min".format( wf.rows * wf.row_secs // 60 ), \
+    state=tk.DISABLED, tags='waterfall' )
+  canvas.create_image( x, y, anchor=tk.NW, image=waterfallImage, \
+    state=tk.DISABLED, tags='waterfall' )
+  canvas.create_rectangle( x - 1, y - 1, x + w, y + h, outline=fg, \
+    state=tk.DISABLED, tags='waterfall' )
+  canvas.create_text( x, y + h + 2, anchor=tk.NW, fill=fg, \
+    font=callfont, state=tk.DISABLED, tags='waterfall', \
+    text="Clear {} Hz".format( ' '.join( \
+      str(hz) for hz in wf.activity.quiet() )))
+
+def waterfall_tick():
+  drawWaterfall()
+  window.after( waterfall_interval, waterfall_tick )
+
 # Remove the logo that appears at startup.
 def remove_logo():
   global canvas, logo
   canvas.delete(logo)
   logo = None
 
-def needupdate( why=None ):
-  global update_needed, FLAGS
+# Ask for the map to be redrawn.  The redraw happens once the
+# Tk event loop is idle, so a burst of changes costs one repaint.
+# Only station 's', if given, needs to be drawn again unless 'full'
+# says that everything does.
+def needupdate( why=None, s=None, full=False ):
+  global update_needed, FLAGS, window, fullredraw
   if FLAGS.debug > 3:
-    if why:
+    if why and s:
+      print("Refresh because {} for {}".format(why, s.call))
+    elif why:
       print("Refresh because {}".format(why))
+  if s:
+    dirty.add( s )
+  if full:
+    fullredraw = True
+  if not update_needed and window:
+    window.after_idle( repaint )
   update_needed = True
 
 # Recompute the zoom factors to preserve aspect ratio.
+@stats.timed( 'rezoom' )
 def rezoom():
   global minx, miny, maxx, maxy, xscale, yscale, swid, shgt
   global worldmap, cropneeded, fitneeded, doingcrop
@@ -433,15 +621,22 @@ def rezoom():
       fitneeded = False
       worldmap.fit()
 
-# Update the entire map.
+# Update the map, if anything has changed.
 def repaint():
-  global canvas, callfont, swid, shgt, minx, miny, maxx, maxy
-  global congestion, xscale, yscale, update_needed, doingcrop, gamut
-  global FLAGS, menuLockFLag
-
+  global update_needed
   if not update_needed:
     return
   update_needed = False
+  _repaint()
+
+# Only stations that changed are drawn again, unless the map was
+# zoomed or something else affects them all.  This is timed apart
+# from repaint(), which is mostly called with nothing to do.
+@stats.timed( 'repaint' )
+def _repaint():
+  global canvas, callfont, swid, shgt, minx, miny, maxx, maxy
+  global congestion, xscale, yscale, doingcrop, gamut
+  global FLAGS, menuLockFLag, dirty, fullredraw
 
   # Remove all 'temporary' objects.
   canvas.delete("temp")
@@ -458,7 +653,20 @@ def repaint():
     print(" Xspan {:.1f} scale {:.1f} Yspan {:.1f} scale {:.1f}".format( \
       xspan, xscale, yspan, yscale))
 
-  sta.Station.drawall(doingcrop)
+  some = dirty
+  dirty = set()
+  if doingcrop or fullredraw:
+    fullredraw = False
+    if doingcrop:
+      spatial.clear()
+      indexed.clear()
+    sta.Station.drawall(doingcrop)
+    if doingcrop:
+      moveActions()
+    stats.count( 'full repaints' )
+  else:
+    sta.Station.drawall(False, some)
+    stats.count( 'stations redrawn', len(some) )
 
   # Report observed activity level.
   duration = (datetime.datetime.now() - resetTime).seconds
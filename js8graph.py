@@ -0,0 +1,209 @@
+# JS8GRAPH: Who hears whom in the JS8 network
+'''
+    This module is part of JS8MAP.  It keeps a table of directed
+    edges between stations, identified by their integer station IDs.
+    Each edge remembers when it was first and last seen, the SNR and
+    the kind of message that last showed it.  Adding or refreshing an
+    edge takes constant time, and old edges can be expired in bulk
+    without looking at the rest.
+
+    Who has heard whom is kept for the whole session and there is a
+    lot of it, so Hears only keeps the station IDs and the time each
+    was last heard, packed into arrays.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import time
+from array import array
+from collections import OrderedDict
+
+#### One directed edge, from one station to another.
+class Edge:
+
+  __slots__ = ('sfr', 'sto', 'first', 'last', 'snr', 'kind')
+
+  def __init__(self, sfr, sto, when, snr, kind):
+    self.sfr = sfr         # Station IDs
+    self.sto = sto
+    self.first = when      # Times first and last seen
+    self.last = when
+    self.snr = snr         # Signal report, if known
+    self.kind = kind       # JS8CALL command that showed it
+
+# Edges are indexed by a single integer made from both station IDs,
+# which takes much less memory than a tuple.
+def key( sfr, sto ):
+  return (sfr << 32) | sto
+
+#### A set of edges, indexed by the station they come from.  If
+#### 'expiring', the edges are also kept in a table in order of when
+#### each was last seen, oldest first, so expiry only looks at the
+#### edges it removes.  A graph that never expires does without
+#### the table, which saves memory.
+class Graph:
+
+  def __init__(self, expiring=False):
+    self.expiring = expiring
+    self.clear()
+
+  def clear(self):
+    self.out = {}                # from: {to: Edge}
+    self.count = 0
+    self.edges = None
+    if self.expiring:
+      self.edges = OrderedDict() # key(from, to): Edge
+
+  # Add an edge, or bring an existing one up to date.  Returns the
+  # edge.
+  def add(self, sfr, sto, snr=None, kind=None, when=None):
+    if when is None:
+      when = time.time()
+    o = self.out.get( sfr )
+    e = o.get( sto ) if o else None
+    if e:
+      e.last = when
+      if snr is not None:
+        e.snr = snr
+      if kind is not None:
+        e.kind = kind
+      if self.expiring:
+        self.edges.move_to_end( key( sfr, sto ))
+    else:
+      e = Edge( sfr, sto, when, snr, kind )
+      if o is None:
+        self.out[sfr] = { sto: e }
+      else:
+        o[sto] = e
+      self.count += 1
+      if self.expiring:
+        self.edges[ key( sfr, sto ) ] = e
+    return e
+
+  def get(self, sfr, sto):
+    o = self.out.get( sfr )
+    if o:
+      return o.get( sto )
+    return None
+
+  def remove(self, sfr, sto):
+    o = self.out.get( sfr )
+    if not o or sto not in o:
+      return None
+    e = o.pop( sto )
+    if not o:
+      del self.out[sfr]
+    self.count -= 1
+    if self.expiring:
+      del self.edges[ key( sfr, sto ) ]
+    return e
+
+  # IDs of the stations a station has an edge to.
+  def targets(self, sfr):
+    o = self.out.get( sfr )
+    if o is None:
+      return ()
+    return o.keys()
+
+  # Remove every edge to or from any of a set of stations.  This
+  # looks at every edge once, however many stations go.
+  def drop(self, sids):
+    for e in [e for e in self if e.sfr in sids or e.sto in sids]:
+      self.remove( e.sfr, e.sto )
+
+  # Remove every edge last seen before 'cutoff'.  Returns the
+  # edges removed.
+  def expire(self, cutoff):
+    gone = []
+    edges = self.edges
+    while edges:
+      e = next( iter( edges.values() ))
+      if e.last >= cutoff:
+        break
+      self.remove( e.sfr, e.sto )
+      gone.append( e )
+    return gone
+
+  def __len__(self):
+    return self.count
+
+  def __iter__(self):
+    for o in self.out.values():
+      yield from o.values()
+
+#### Which stations each station has heard, and when it last heard
+#### them.  For each station there is an array of the IDs it heard
+#### and a parallel array of times in seconds since 1970.  The lists
+#### are short, so a station is found in them by looking through.
+class Hears:
+
+  def __init__(self):
+    self.clear()
+
+  def clear(self):
+    self.to = {}                 # from: array of IDs heard
+    self.when = {}               # from: array of times last heard
+    self.count = 0
+
+  # Note that 'sfr' heard 'sto'.  Returns True if it had not before.
+  def add(self, sfr, sto, when=None):
+    if when is None:
+      when = time.time()
+    when = int( when )
+    to = self.to.get( sfr )
+    if to is None:
+      self.to[sfr] = array( 'i', (sto,) )
+      self.when[sfr] = array( 'I', (when,) )
+    elif sto in to:
+      self.when[sfr][to.index( sto )] = when
+      return False
+    else:
+      to.append( sto )
+      self.when[sfr].append( when )
+    self.count += 1
+    return True
+
+  # When 'sfr' last heard 'sto', or None if it has not.
+  def last(self, sfr, sto):
+    to = self.to.get( sfr )
+    if to is None or sto not in to:
+      return None
+    return self.when[sfr][to.index( sto )]
+
+  # IDs of the stations a station has heard.
+  def targets(self, sfr):
+    return self.to.get( sfr, () )
+
+  # Forget what any of a set of stations heard, and that they were
+  # heard.
+  def drop(self, sids):
+    for sfr in list( self.to ):
+      to = self.to[sfr]
+      if sfr in sids:
+        keep = []
+      elif any( t in sids for t in to ):
+        keep = [i for i, t in enumerate( to ) if t not in sids]
+      else:
+        continue
+      self.count -= len(to) - len(keep)
+      if keep:
+        when = self.when[sfr]
+        self.to[sfr] = array( 'i', (to[i] for i in keep) )
+        self.when[sfr] = array( 'I', (when[i] for i in keep) )
+      else:
+        del self.to[sfr]
+        del self.when[sfr]
+
+  def __len__(self):
+    return self.count
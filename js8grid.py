@@ -0,0 +1,53 @@
+# JS8GRID: Maidenhead grid conversions
+'''
+    This module is part of JS8MAP.  It converts between Maidenhead
+    grid names and longitude and latitude.  It does not depend on
+    tkinter or PIL so it can be used without a display.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+# Convert grid name to longitude and latitude degrees.
+# Cells go A-R for 360 degrees or 20 deg per major cell in
+# longitude, and A-R for 180 degrees in latitude.
+# So cells are twice as wide as they are tall.
+def grid2coord(g):
+  if len(g) < 4:
+    print("Bad grid '{}'".format(g))
+    return (-90,40)
+
+  lng = ((ord(g[0]) - ord('A')) * 10 + (ord(g[2]) - ord('0'))) * 2 - 180+1
+  lat = ((ord(g[1]) - ord('A')) * 10 + (ord(g[3]) - ord('0'))) - 90
+  
+  return (lng, lat)
+
+# Convert a Latitude and Longitude to a grid coordinate.
+def ll2grid(lng, lat):
+  # Correct origins
+  lat1=lat+90
+  lng1=lng+180
+  # Scale to A-R in 18 steps.  360/18 = 20 and 180/18 = 10.
+  lnga = lng1/20
+  latb = lat1/10
+  # Split high and low order
+  lnga1 = int(lnga)
+  lngc1 = int((lnga - lnga1)*10)
+  latb1 = int(latb)
+  latd1 = int((latb - latb1)*10)
+  # High order becomes letters, lo order becomes digits
+  a = chr(65+lnga1)
+  b = chr(65+latb1)
+  c = chr(48+lngc1)
+  d = chr(48+latd1)
+  return a + b + c + d
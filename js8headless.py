@@ -0,0 +1,84 @@
+# JS8HEADLESS: Collect station and network data without a display
+'''
+    This module is part of JS8MAP.  It runs the UDP listener, the
+    callbook and the station model on an asyncio event loop, with no
+    tkinter or PIL, for monitoring stations that have no display.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import signal
+import asyncio
+import js8explore as explore
+import js8station as sta
+import js8ingest
+
+FLAGS = None
+loop = None
+
+# The rest of JS8MAP schedules work with the tkinter after() method.
+# This gives the same thing on top of an asyncio loop.
+class Scheduler:
+
+  def __init__(self, lp):
+    self.loop = lp
+
+  def after(self, ms, func, *args):
+    return self.loop.call_later( ms / 1000, func, *args )
+
+def showband( bands ):
+  print("JS8 network on {} MHz".format(bands))
+
+# Run until interrupted.
+def run( fl ):
+  global FLAGS, loop
+  FLAGS = fl
+
+  loop = asyncio.new_event_loop()
+  asyncio.set_event_loop( loop )
+  window = Scheduler( loop )
+
+  # Each JS8CALL source has its own UDP port.
+  if not js8ingest.open_sources( FLAGS.ports ):
+    return
+
+  explore.start( window, FLAGS )
+  sta.start( FLAGS )
+  sta.load()      # Before any message is read
+  js8ingest.start( FLAGS, window, None, showband )
+  js8ingest.listen( loop, js8ingest.take )
+  if FLAGS.metrics_port:
+    import js8metrics
+    js8metrics.start( FLAGS, window )
+
+  if FLAGS.debug > 0:
+    print("Listening for JS8CALL on port {}".format(FLAGS.port))
+
+  # Stop cleanly when the service is stopped, so that the callbook
+  # and capture are written out at exit.  Windows has no signal
+  # handlers in asyncio.
+  try:
+    loop.add_signal_handler( signal.SIGTERM, loop.stop )
+  except NotImplementedError:
+    pass
+
+  try:
+    loop.run_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    loop.close()
+
+  # At exit, list the stations we never learned the location of.
+  sta.missing()
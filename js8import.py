@@ -0,0 +1,271 @@
+# JS8IMPORT: Load station locations from other programs' files
+'''
+    This module is part of JS8MAP.  It reads callsigns and grids from
+    CSV files and ADIF logs and merges them into the reference
+    callbook, so that a new installation knows where stations are
+    before it has heard them send a grid.
+
+    Files of any size can be imported.  Entries are sorted in
+    batches that are written to temporary files, and the batches are
+    then merged with the existing callbooks in a single pass, so the
+    memory used does not grow with the size of the input.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import os
+import re
+import csv
+import heapq
+import itertools
+import tempfile
+import datetime
+import calendar
+import js8callbook
+
+FLAGS = None
+runsize = 100000        # Entries sorted in memory at one time
+rejected = 0            # Entries left out because they made no sense
+callpat = re.compile('^[0-9A-Z/]{3,16}$')
+gridpat = re.compile('^[A-R]{2}[0-9]{2}$')
+fieldpat = re.compile(r'<(\w+)(?::(\d+))?(?::\w)?>')
+
+# Column names that may hold each item in a CSV file with a header.
+callcols = ('call', 'callsign', 'station_callsign')
+gridcols = ('grid', 'gridsquare', 'locator', 'loc')
+timecols = ('time', 'updated', 'date', 'timestamp')
+
+# Check an entry read from a file.  Returns a (call, grid) pair in
+# the form the callbook uses, or None if either is not sensible.
+def clean( call, grid ):
+  call = call.strip().upper()
+  grid = grid.strip().upper()[0:4]
+  if re.match( callpat, call ) and re.match( gridpat, grid ):
+    return (call, grid)
+  return None
+
+# Convert a date and time in one of the usual forms to seconds
+# since 1970, or None if it can not be understood.  A time without
+# a zone is taken to be UTC.
+def totime( s ):
+  s = s.strip()
+  if s == '':
+    return None
+  try:
+    return float(s)
+  except ValueError:
+    pass
+  try:
+    d = datetime.datetime.fromisoformat( s.replace('Z', '+00:00') )
+  except ValueError:
+    return None
+  if d.tzinfo:
+    return int( d.timestamp() )
+  return calendar.timegm( d.timetuple() )
+
+# The reference callbook keeps times as unsigned 32 bit numbers,
+# which run from 1970 to 2106.
+def intime( t ):
+  return 0 <= t < 2**32
+
+# Pass on entries whose time fits in the reference callbook, and
+# count the others as rejected.
+def checktimes( entries ):
+  global rejected
+  for e in entries:
+    if intime( e[2] ):
+      yield e
+    else:
+      rejected += 1
+
+# Entries from a CSV file.  If the first line names the columns,
+# they are found by name.  Otherwise each line has the callsign,
+# the grid and optionally the time, like the callbook.dat file.
+def read_csv( fname, when ):
+  with open( fname, "r", newline='', errors='replace' ) as f:
+    rows = csv.reader( r for r in f if r.strip() and r[0] != '#' )
+    first = next( rows, None )
+    if first is None:
+      return
+    names = [n.strip().lower() for n in first]
+    ccol = next( (names.index(n) for n in callcols if n in names), None )
+    gcol = next( (names.index(n) for n in gridcols if n in names), None )
+    tcol = next( (names.index(n) for n in timecols if n in names), None )
+    if ccol is None or gcol is None:
+      ccol, gcol, tcol = 0, 1, 2
+      rows = itertools.chain( [first], rows )
+    for r in rows:
+      if len(r) <= max(ccol, gcol):
+        continue
+      e = clean( r[ccol], r[gcol] )
+      if e:
+        t = None
+        if tcol is not None and len(r) > tcol:
+          t = totime( r[tcol] )
+        yield (e[0], e[1], t or when)
+
+# Entries from an ADIF log.  Each record is a list of fields like
+# <CALL:5>W1ABC ending with <EOR>.  The QSO date and time, if given,
+# tell how recent the grid is.
+def read_adif( fname, when ):
+  rec = {}
+  with open( fname, "r", errors='replace' ) as f:
+    text = ''
+    for line in f:
+      text += line
+      pos = 0
+      while True:
+        m = fieldpat.search( text, pos )
+        if not m:
+          break
+        name = m.group(1).upper()
+        if m.group(2) is not None:
+          end = m.end() + int(m.group(2))
+          if end > len(text):
+            break          # The value continues on the next line
+          rec[name] = text[m.end():end]
+          pos = end
+          continue
+        pos = m.end()
+        if name == 'EOH':
+          rec = {}
+        elif name == 'EOR':
+          e = clean( rec.get('CALL', ''), rec.get('GRIDSQUARE', '') )
+          if e:
+            yield (e[0], e[1], adiftime( rec ) or when)
+          rec = {}
+      text = text[pos:]
+
+def adiftime( rec ):
+  d = rec.get('QSO_DATE', '')
+  t = rec.get('TIME_ON', '0000').ljust(6, '0')
+  try:
+    d = datetime.datetime.strptime( d + t[0:6], '%Y%m%d%H%M%S' )
+  except ValueError:
+    return None
+  return calendar.timegm( d.timetuple() )
+
+# Entries from any file we know how to read.
+def read( fname ):
+  when = os.path.getmtime( fname )
+  if os.path.splitext( fname )[1].lower() in ('.adi', '.adif'):
+    return checktimes( read_adif( fname, when ))
+  return checktimes( read_csv( fname, when ))
+
+# Sort entries in batches of 'runsize', writing each batch to a
+# temporary file in the reference callbook format.  The files are
+# added to 'runs' before they are written, so that they are removed
+# even if writing fails.
+def sort_runs( entries, tmpdir, runs ):
+  while True:
+    batch = list( itertools.islice( entries, runsize ))
+    if not batch:
+      return
+    batch.sort( key=lambda e: e[0] )
+    fd, fname = tempfile.mkstemp( suffix='.run', dir=tmpdir )
+    os.close( fd )
+    runs.append( fname )
+    js8callbook.RefBook.write( fname, batch )
+
+# Merge sorted streams of entries.  Where a callsign turns up more
+# than once, the entry with the newest time wins.  On a tie the
+# earlier stream wins, so existing entries are kept.
+def merge( streams ):
+  for call, group in itertools.groupby( heapq.merge( *streams,
+                                        key=lambda e: e[0] ),
+                                        key=lambda e: e[0] ):
+    best = next( group )
+    for e in group:
+      if e[2] > best[2]:
+        best = e
+    yield best
+
+# Pass the merged entries through, and bring the database up to date
+# where an imported grid is newer than the one it has.  Otherwise the
+# database would hide the imported grid, as it is looked in first.
+def update_book( merged, book ):
+  changes = []
+  cur = book.db.cursor()
+  for call, grid, t in merged:
+    old = cur.execute( 'SELECT grid, updated FROM calls WHERE call = ?',
+                       (call,) ).fetchone()
+    if old and old[1] < t and old[0] != grid:
+      changes.append( (grid, t, call) )
+      if len(changes) >= runsize:
+        apply_changes( book, changes )
+        changes = []
+    yield (call, grid, t)
+  apply_changes( book, changes )
+
+# Entries of an existing reference callbook, which is closed when
+# they have all been read so the new one can take its place.
+def existing( ref ):
+  yield from ref.entries()
+  ref.close()
+
+def apply_changes( book, changes ):
+  if changes:
+    with book.db:
+      book.db.executemany(
+        'UPDATE calls SET grid = ?, updated = ? WHERE call = ?', changes )
+
+# Import each of the named files into the reference callbook.
+def run( fl, files ):
+  global FLAGS
+  FLAGS = fl
+
+  if not files:
+    print("Nothing to import.  Give CSV or ADIF files to read.")
+    return 1
+  for fname in files:
+    if not os.path.isfile( fname ):
+      print("No such file {}".format(fname))
+      return 1
+
+  book = js8callbook.Callbook( FLAGS.book )
+  old = None
+  if os.path.isfile( FLAGS.reference ):
+    old = js8callbook.RefBook( FLAGS.reference )
+  tmpdir = os.path.dirname( os.path.abspath( FLAGS.reference ))
+  runs = []
+  readers = []
+  try:
+    for fname in files:
+      n = len(runs)
+      sort_runs( read( fname ), tmpdir, runs )
+      if FLAGS.debug > 0:
+        print("Sorted {} in {} batches".format(fname, len(runs) - n))
+
+    readers = [js8callbook.RefBook( r ) for r in runs]
+    streams = [r.entries() for r in readers]
+    if old:
+      streams.insert( 0, existing( old ))
+    count = js8callbook.RefBook.write( FLAGS.reference,
+                                       update_book( merge( streams ), book ))
+  finally:
+    for r in readers:
+      r.close()
+    for r in runs:
+      if os.path.exists( r ):
+        os.remove( r )
+    if old:
+      old.close()
+    book.close()
+
+  print("Reference callbook {} has {} stations".format(
+    FLAGS.reference, count))
+  if rejected:
+    print("Left out {} entries dated before 1970 or after 2106".format(
+      rejected))
+  return 0
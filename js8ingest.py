@@ -0,0 +1,427 @@
+# JS8INGEST: Interpret events reported by JS8CALL
+'''
+    This module is part of JS8MAP.  It reads UDP messages from
+    JS8CALL and updates the station and network model.  It does
+    not depend on tkinter, so it serves both the map display and
+    the headless mode.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import socket
+import asyncio
+import datetime
+import time
+import atexit
+import js8parse
+import js8capture
+import js8station as sta
+import js8timer
+import js8stats as stats
+import js8rate
+import js8waterfall
+import js8explore as explore
+import js8null as draw
+
+FLAGS = None
+window = None      # Anything with a tkinter-style after() method
+onband = None      # Called with the bands when one changes
+
+sources = []       # One Source for each UDP port
+capture = None     # Where every message is recorded, if anywhere
+congestion = 0
+received = 0    # UDP messages read from the socket
+processed = 0   # UDP messages handled
+dropped = 0     # UDP messages that could not be understood
+flush_interval = 60 * 1000
+measurement_interval = 10 * 60000   # Ten Minute measurement interval
+congestion_interval = 5000          # Milliseconds between rate updates
+
+# 'w' schedules the periodic jobs, 'drawer' is the module that
+# draws the map, and 'bandfunc' is told about band changes.
+def start( fl, w, drawer=None, bandfunc=None ):
+  global FLAGS, window, draw, onband, flush_interval, capture
+  FLAGS = fl
+  window = w
+  if drawer:
+    draw = drawer
+  onband = bandfunc
+  flush_interval = FLAGS.flush * 1000
+  stats.start( FLAGS, window )
+
+  if FLAGS.capture:
+    capture = js8capture.Writer( FLAGS.capture )
+    atexit.register( capture.close )
+    if FLAGS.debug > 0:
+      print("Recording messages in {}".format(FLAGS.capture))
+
+  # Schedule some events to happen later.  They will reschedule
+  # themselves.  Times are in milliseconds.
+  window.after( measurement_interval, measure)  # Report statistics
+  window.after( congestion_interval, measure_congestion )
+  js8timer.start( window )    # Fade stations and expire links
+  window.after( flush_interval, save_callbook )  # Write new grids
+
+# Set up UDP port for listening to JS8CALL.
+def open_socket( port ):
+  usock = None
+  try:
+    usock = socket.socket( socket.AF_INET, socket.SOCK_DGRAM )
+    usock.setblocking(False)
+    usock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    usock.bind( ('', port) )
+  except socket.error as msg:
+    print("Socket error on port {}: {}".format(port, msg))
+    usock = None
+  return usock
+
+# Open a UDP port for each JS8CALL instance.  Returns the list
+# of sources that could be opened.
+def open_sources( ports ):
+  global sources
+  for port in ports:
+    usock = open_socket( port )
+    if usock:
+      sources.append( Source( port, usock ) )
+  return sources
+
+# The bands of all sources, for the title bar.
+def bands():
+  return ', '.join( [str(src.band) for src in sources if src.band] )
+
+#### This class represents one JS8CALL instance sending us UDP
+#### messages.  Each one may be on a different band.
+class Source:
+
+  def __init__(self, port, usock):
+    self.port = port
+    self.name = str(port)
+    self.sock = usock
+    self.band = 0          # MHz
+    self.received = 0      # UDP messages from this source
+    self.calls = set()     # Stations heard through this source
+
+  # Get the next waiting message as a (message, source) pair,
+  # or None if there is nothing to read.
+  def next(self):
+    try:
+      msg, address = self.sock.recvfrom(2000)
+    except socket.error:
+      return None
+    return (msg, self)
+
+  # Remember that a station was heard through this source.
+  def heard(self, s):
+    if s:
+      self.calls.add( s.call )
+
+  # Forget the stations only this source has heard, as when
+  # it changes band.
+  def forget(self):
+    others = set()
+    for src in sources:
+      if src is not self:
+        others |= src.calls
+    sta.Station.drop( self.calls - others )
+    self.calls = set()
+
+# An asyncio protocol for one source.  Each datagram is passed to
+# 'deliver' along with its source.
+class JS8Protocol( asyncio.DatagramProtocol ):
+
+  def __init__(self, source, deliver):
+    self.source = source
+    self.deliver = deliver
+
+  def datagram_received(self, data, addr):
+    self.deliver( data, self.source )
+
+  def error_received(self, exc):
+    print("Socket error on port {}: {}".format(self.source.port, exc))
+
+# Start listening to every source on an asyncio loop.
+def listen( loop, deliver ):
+  for src in sources:
+    loop.run_until_complete( loop.create_datagram_endpoint( \
+      lambda s=src: JS8Protocol( s, deliver ), sock=src.sock ))
+
+# Read the messages per hour over the last few minutes.  This is
+# the 'congestion' level and is used to throttle automatic
+# transmissions.
+def measure_congestion():
+  global congestion, window
+  c = js8rate.congestion()
+  explore.congestion = c
+  if c != congestion:
+    congestion = c
+    draw.setCongestion( congestion )
+    draw.needupdate( 'congestion' )
+  window.after( congestion_interval, measure_congestion )
+
+# Report what has been happening.
+def measure():
+  global measurement_interval, window, FLAGS
+  if FLAGS.debug > 0:
+    print("Congestion {}: {} received {} processed {} dropped".format(
+      congestion, received, processed, dropped))
+    print("  {} callbook changes waiting".format(sta.pending()))
+    for src in sources:
+      print("  Port {} on {} MHz: {} messages, {} stations".format(
+        src.name, src.band, src.received, len(src.calls)))
+  if FLAGS.debug > 1:
+    for line in report():
+      print( line )
+  window.after( measurement_interval, measure)
+
+# A list of lines describing the commands handled so far.
+def report():
+  lines = []
+  for n, (count, secs) in sorted( cmdstats.items() ):
+    if count:
+      lines.append("  {:>14}: {} handled, {:.0f} us each".format(
+        n or '(none)', count, secs * 1e6 / count))
+  lines.append("  {:>14}: {}".format( 'other', othercount ))
+  return lines
+
+# Write newly learned grids to the callbook from time to time,
+# and anything recorded so far.
+def save_callbook():
+  global window, flush_interval
+  sta.flush()
+  if capture:
+    capture.flush()
+  window.after( flush_interval, save_callbook )
+
+# Watch frequency changes and tell the display.
+def updatefreq( ev, src ):
+  global onband
+  mhz = int(ev.freq / 1000000)
+  if mhz != src.band:
+    src.band = mhz
+    if onband:
+      onband( bands() )
+    # Also clear out the map because we will find new stations
+    # on this band.  With several sources, only the stations
+    # heard through this one go away.
+    if len(sources) > 1:
+      src.forget()
+    else:
+      src.calls = set()
+      draw.resetTime = datetime.datetime.now()
+      draw.clearHistory()
+      sta.Station.reset()
+
+def BHearsA( s, oth ):
+  global FLAGS
+  if not s or not oth:
+    return
+  if FLAGS.debug > 3:
+    print("{} can hear {}".format( oth.call, s.call ))
+  if s.state == sta.sLOCAL:
+    oth.heardme = True
+    oth.touch()
+  s.addHeard( oth )
+
+########## Handlers for JS8 commands ##########
+# Each JS8 command is handled by a function registered for it in
+# 'commands'.  A handler is called with the event, the sending and
+# receiving stations and the source it came through.  The receiving
+# station can be None if the message was sent to a group.  More
+# commands can be handled by registering functions with command().
+
+commands = {}      # CMD: handler function
+cmdstats = {}      # CMD: [count, seconds spent]
+othercount = 0     # Commands with no handler
+
+# Register a function as the handler for one or more commands.
+# Used as a decorator, or called directly with the function.
+def command( *names, func=None ):
+  def register( f ):
+    for n in names:
+      commands[n] = f
+      cmdstats.setdefault( n, [0, 0.0] )
+    return f
+  if func:
+    return register( func )
+  return register
+
+@command( '' )
+def cmd_plain( ev, sfr, sto, src ):
+  sfr.link( sto, ev.snr, ev.cmd )
+  if FLAGS.debug > 0:
+    print("  {}: {} {}".format(ev.cfr, ev.cto, ev.text))
+
+@command( 'HEARTBEAT', 'GRID' )
+def cmd_grid( ev, sfr, sto, src ):
+  # Somebody advertises their location.
+  loc = ev.grid
+  # Bug in JS8CALL - if station reports 6-character grid,
+  # the GRID field will be empty so we have to look in the text.
+  if len(loc) == 0 and ev.words:
+    loc = ev.words.pop()
+  if ev.cmd == 'HEARTBEAT':
+    sfr.HB()
+  sfr.setgrid( loc )
+
+@command( 'HEARING' )
+def cmd_hearing( ev, sfr, sto, src ):
+  # A good way to learn about stations we can not hear.
+  # The text is CFR: CTO HEARING c1 c2 c3
+  sfr.link( sto, ev.snr, ev.cmd )
+  if FLAGS.debug > 1:
+    print('{} hears {}'.format(sfr.call, ev.words))
+  for s in sfr.sethears( ev.words ):
+    src.heard( s )
+
+@command( 'HEARTBEAT SNR', 'SNR' )
+def cmd_snr( ev, sfr, sto, src ):
+  # A station sending an SNR report has presumably heard the
+  # station they are sending it to.
+  if sto:
+    BHearsA( sto, sfr )
+    sfr.link( sto, ev.snr, ev.cmd )
+    sto.link( sfr, None, ev.cmd )
+
+@command( 'SNR?' )
+def cmd_link( ev, sfr, sto, src ):
+  sfr.link( sto, ev.snr, ev.cmd )
+
+# If somebody replies NO, then they must have heard the query.
+# The same goes for a message or a copy query.
+@command( 'NO', 'YES', 'MSG', 'HW CPY?' )
+def cmd_reply( ev, sfr, sto, src ):
+  sfr.link( sto, ev.snr, ev.cmd )
+  BHearsA( sto, sfr )
+
+@command( 'INFO' )
+def cmd_info( ev, sfr, sto, src ):
+  sfr.info = ev.text
+  if FLAGS.debug > 0:
+    print('{} info {}'.format(sfr.call, ev.text))
+
+@command( 'CQ' )
+def cmd_cq( ev, sfr, sto, src ):
+  # It is common to send a message of "CQ CQ CQ grid"
+  if ev.words:
+    loc = ev.words.pop()
+    if len(loc) == 4:
+      sfr.setgrid( loc )
+  sfr.CQ()
+
+@command( 'ACK' )
+def cmd_ack( ev, sfr, sto, src ):
+  if sto:
+    sto.addHeard(sfr)
+  sfr.link( sto, ev.snr, ev.cmd )
+
+# Process a CMD event from JS8CALL.  These represents all
+# the substantive messages.  'src' is where it came from.
+@stats.timed( 'do_cmd' )
+def do_cmd(ev, src):
+  global othercount, FLAGS
+
+  # Collect data for congestion computation.  A garbled sender
+  # still adds to the congestion.
+  sfr = sta.gotStation(ev.cfr)
+  js8rate.heard( sfr.id if sfr else None, ev.offset )
+  js8waterfall.heard( ev.offset, ev.snr )
+
+  if FLAGS.debug>2:
+    print('{} to {} SNR={} TD={:.1f} OFF={} says "{}"'.format( \
+        ev.cfr, ev.cto, ev.snr, ev.tdrift, ev.offset, ev.text))
+
+  # But it is no use to us otherwise.
+  if not sfr:
+    return
+  sto = sta.gotStation(ev.cto)
+  src.heard( sfr )
+  src.heard( sto )
+
+  # Remember that we have heard these stations.  There might
+  # be no destination station if it was a group.
+  sfr.hear()
+  sfr.level = ev.snr
+  if sto:
+    sto.hear( sfr.heard )
+    # A message sent to me suggests the other station
+    # has heard me.
+    BHearsA( sfr, sto )
+
+  handler = commands.get( ev.cmd )
+  if handler is None:
+    # Ignore anything else
+    othercount += 1
+    if FLAGS.debug > 4:
+      print("Other CMD: {} {}".format( ev.cmd, ev.text))
+    return
+
+  start = time.perf_counter()
+  handler( ev, sfr, sto, src )
+  st = cmdstats[ev.cmd]
+  st[0] += 1
+  st[1] += time.perf_counter() - start
+
+# Handle one UDP message from JS8CALL that came from 'src'.
+# Returns False if the message could not be understood.
+def handle_message( msg, src ):
+  ev = js8parse.parse( msg )
+  if ev is None:
+    return False
+
+  if ev.kind == js8parse.eCMD:
+    do_cmd(ev, src)
+
+  # Our own transmissions get counted
+  elif ev.kind == js8parse.eTX:
+    js8rate.heard()
+
+  # Watch for band changes
+  elif ev.kind == js8parse.eDIAL:
+    updatefreq( ev, src )
+
+  return True
+
+# Count and handle one UDP message.
+def take( msg, src ):
+  global received, processed, dropped
+  received += 1
+  src.received += 1
+  if capture:
+    capture.write( msg, src.port )
+  if handle_message( msg, src ):
+    processed += 1
+  else:
+    dropped += 1
+
+# Process everything waiting, up to FLAGS.batch messages, so that
+# a busy band does not overflow the socket buffer.  Returns the
+# number of messages read.  'getmsg' returns the next message
+# and its source, or None when there are no more.
+@stats.timed( 'read_messages' )
+def read_messages( getmsg ):
+  global FLAGS, received, processed, dropped
+
+  count = 0
+  while count < FLAGS.batch:
+    item = getmsg()
+    if item is None:
+      break
+    count += 1
+    take( *item )
+
+  if FLAGS.debug > 3 and count > 0:
+    print("Batch of {} messages, {} received {} processed {} dropped".format(
+      count, received, processed, dropped))
+  return count
+
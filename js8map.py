@@ -20,6 +20,28 @@
 import argparse
 import os, sys
 import socket
+import asyncio
+import threading
+from collections import deque
+import js8config as cfg
+
+# Load configuration from INI file and command line.
+FLAGS = cfg.start()
+
+if FLAGS.debug > 0:
+  print("Settings: {}".format(FLAGS))
+
+# Importing station locations needs no display either.
+if FLAGS.command == 'import':
+  import js8import
+  sys.exit( js8import.run( FLAGS, FLAGS.files ))
+
+# Without a display there is no need for tkinter or PIL at all.
+if FLAGS.headless:
+  import js8headless
+  js8headless.run( FLAGS )
+  sys.exit()
+
 from PIL import Image, ImageFont, ImageDraw
 from PIL import ImageTk
 import tkinter as tk
@@ -30,22 +52,17 @@ import json
 import re
 import js8explore as explore
 import js8station as sta
+import js8ingest
 import js8draw as draw
 import js8world as world
-import js8config as cfg
-
-# Load configuration from INI file and command line.
-FLAGS = cfg.start()
-
-if FLAGS.debug > 0:
-  print("Settings: {}".format(FLAGS))
+import js8stats as stats
+import js8rate
 
 ####### Initialize globals
-band = 0
-congestion = 0
-cmdcount = 0
-link_interval = FLAGS.link_timeout * 60 * 1000
-measurement_interval = 10 * 60000   # Ten Minute measurement interval
+ingest = 'poll'     # How UDP messages are noticed
+inbox = deque()     # Messages read by the receiver thread
+wakeup = False      # Receiver thread has woken the Tk thread
+statsWindow = None  # Statistics panel, when open
 
 ########## Processing user inputs ###########
   
@@ -54,7 +71,7 @@ def toggleIcons(x=None):
   if x:
     showIconsFlag.set( 1 - showIconsFlag.get() )
   FLAGS.icon = showIconsFlag.get() > 0
-  draw.needupdate('Icons')
+  draw.needupdate('Icons', full=True)
 
 def toggleHistory(x=None):
   global FLAGS, showHistoryFlag
@@ -63,10 +80,66 @@ def toggleHistory(x=None):
   draw.showHistory = showHistoryFlag.get() > 0
   if showHistoryFlag.get() == 0:
     draw.clearHistory()
-  draw.needupdate('History')
+  draw.needupdate('History', full=True)
+
+def toggleHover(x=None):
+  global showHoverFlag
+  if x:
+    showHoverFlag.set( 1 - showHoverFlag.get() )
+  draw.showHover = showHoverFlag.get() > 0
+
+# A window listing how much work JS8MAP has done and how long it
+# took.  It is refreshed every second until it is closed.
+def showStats(x=None):
+  global statsWindow, statsText
+  if statsWindow:
+    statsWindow.lift()
+    return
+  statsWindow = tk.Toplevel( window )
+  statsWindow.title( 'JS8MAP statistics' )
+  statsWindow.protocol( 'WM_DELETE_WINDOW', closeStats )
+  statsText = tk.Text( statsWindow, width=64, height=30, \
+                       font=('Courier', 11) )
+  statsText.pack( fill=tk.BOTH, expand=True )
+  updateStats()
+
+def updateStats():
+  if not statsWindow:
+    return
+  lines = stats.report()
+  lines.append( "Congestion {}: {} received {} processed {} dropped".format(
+    js8ingest.congestion, js8ingest.received, js8ingest.processed,
+    js8ingest.dropped ))
+  lines += js8ingest.report()
+  lines.append( "{} stations, {} callbook changes waiting".format(
+    len(sta.Station.book), sta.pending() ))
+  lines.append( "Busiest stations, messages/hour:" )
+  for sid, n in js8rate.traffic.busiest( 5 ):
+    s = sta.Station.byid[sid]
+    if s:
+      lines.append( "  {:>14}: {:.0f}".format( s.call,
+        js8rate.station( sid )))
+  lines.append( "Busiest offsets, messages/hour:" )
+  for hz, rate in js8rate.busy_offsets( 5 ):
+    lines.append( "  {:>11} Hz: {:.0f}".format( hz, rate ))
+  statsText.delete( '1.0', tk.END )
+  statsText.insert( tk.END, '\n'.join( lines ))
+  window.after( 1000, updateStats )
+
+def closeStats():
+  global statsWindow
+  statsWindow.destroy()
+  statsWindow = None
+
+def toggleWaterfall(x=None):
+  global showWaterfallFlag
+  if x:
+    showWaterfallFlag.set( 1 - showWaterfallFlag.get() )
+  draw.showWaterfall = showWaterfallFlag.get() > 0
+  draw.drawWaterfall()
 
 def setmap(mnum):
-  world.World.setmap( mnum )
+  draw.worldmap.setmap( mnum )
   draw.cropneeded = True
   draw.needupdate('Map')
 
@@ -107,216 +180,119 @@ def dump(x=None):
   for s in sta.Station.book.values():
     s.dump()
 
-######### Processing events from JS8CALL ##############
-# Compute average messages per hour.  This is the 'congestion'
-# level and is used to throttle automatic transmissions.
-def measure():
-  global cmdcount, measurement_interval, window
-  global congestion
-  congestion = int(cmdcount * 3.6E6 / measurement_interval)
-  cmdcount = 0
-  draw.needupdate( 'measure' )
-  draw.setCongestion( congestion )
-  window.after( measurement_interval, measure)
-
-# Look for obsolete links from time to time.
-def check_links():
-  global window, link_interval
-  for s in sta.Station.book.values():
-    s.purgelinks()
-  window.after( link_interval, check_links )
-
 # Force quit.
 def manual_quit(x):
   sys.exit()
 
-# Watch frequency changes and update title bar.
-def updatefreq( js8 ):
-  global window, band
-  mhz = int(js8['FREQ'] / 1000000)
-  if mhz != band:
-    band = mhz
-    window.title("JS8 network on {} MHz".format(band))
-    # Also clear out the map because we will find new stations
-    # on this band.
-    draw.resetTime = datetime.datetime.now()
-    draw.clearHistory()
-    sta.Station.reset()
-
-def BHearsA( s, oth ):
-  global FLAGS
-  if not s or not oth:
-    return
-  if FLAGS.debug > 3:
-    print("{} can hear {}".format( oth.call, s.call ))
-  if s.state == sta.sLOCAL:
-    oth.heardme = True
-    oth.changed = True
-  s.addHeard( oth )
-
-# Process a CMD event from JS8CALL.  These represents all
-# the substantive messages.
-def do_cmd(js8):
-  global window,band, cmdcount, FLAGS, msg
-
-  c = js8['CMD'].strip()
-
-  # Collect misc statistics
-  tdrift = float(js8['TDRIFT'])
-  offset = int(js8['OFFSET'])
-
-  # Strip callsigns of extraneous modifiers
-  cfr = sta.clean(js8['FROM'])
-  cto = sta.clean(js8['TO'])
-  lvl = int(js8['SNR'])
-
-  sfr = sta.gotStation(cfr)
-  sto = sta.gotStation(cto)
-
-  # Several commands have useful information in the TEXT field.
-  # We split it up for easy processing, and remove the
-  # 'end-of-transmission' marker.
-  txtlist = js8['TEXT'].strip().split(' ')[3:]
-  if len(txtlist) > 0:
-    txtlist.pop()
-  txt = ' '.join(txtlist)
-
-  if FLAGS.debug>2:
-    print('{} to {} SNR={} TD={:.1f} OFF={} says "{}"'.format( \
-        cfr, cto, lvl, tdrift, offset, txt))
-
-  # Remember that we have heard these stations.  There might
-  # be no destination station if it was a group.
-  sfr.heard = datetime.datetime.now()
-  sfr.level = lvl
-  sfr.reported = 1
-  if sto:
-    sto.reported = 1
-    sto.heard = sfr.heard
-    # A message sent to me suggests the other station
-    # has heard me.
-    BHearsA( sfr, sto )
-
-  if c == '':
-    sfr.link( sto )
-    if FLAGS.debug > 0:
-      t = js8['TEXT'].strip()
-      print("  {}".format(t))
-
-  elif c == 'HEARTBEAT' or c == 'GRID':   
-    # Somebody advertises their location.
-    loc = js8['GRID'].strip()
-    # Bug in JS8CALL - if station reports 6-character grid,
-    # the GRID field will be empty so we have to look in the text.
-    if len(loc) == 0:
-      loc = txtlist.pop()
-    if c == 'HEARTBEAT':
-      sfr.HB()
-    sfr.setgrid( loc )
-
-  elif c == 'HEARING':
-    # A good way to learn about stations we can not hear.
-    # The text is CFR: CTO HEARING c1 c2 c3
-    sfr.link(sto)
-    if FLAGS.debug > 1:
-      print('{} hears {}'.format(sfr.call, txtlist))
-    sfr.sethears( txtlist )
-
-  elif c == 'HEARTBEAT SNR' or c == 'SNR':
-    # A station sending an SNR report has presumably heard the
-    # station they are sending it to.
-    if sto:
-      BHearsA( sto, sfr )
-      sfr.link( sto )
-      sto.link( sfr )
-
-  elif c == 'SNR?':
-    sfr.link( sto )
-
-  elif c == 'NO' or c == 'YES':
-    # If somebody replies NO, then they must have
-    # heard the query.
-    sfr.link( sto )
-    BHearsA( sto, sfr )
-
-  elif c == 'INFO':
-    sfr.info = txt
-    if FLAGS.debug > 0:
-      print('{} info {}'.format(sfr.call, txt))
-
-  elif c == 'CQ':
-    # It is common to send a message of "CQ CQ CQ grid"
-    loc = txtlist.pop()
-    if len(loc) == 4:
-      sfr.setgrid( loc )
-    sfr.CQ()
-
-  elif c == 'INFO' or c == 'MSG':
-    sfr.link( sto )
-    BHearsA( sto, sfr )
-
-  elif c == 'ACK':
-    sto.addHeard(sfr)
-    sfr.link( sto )
-
-  elif c == 'HW CPY?':
-    BHearsA( sto, sfr )
-    sfr.link(sto)
-
-  else:
-    # Ignore anything else
-    if FLAGS.debug > 4:
-      print("Other CMD: {} {}".format( c, txt))
-
-  # Collect data for congestion computation.
-  cmdcount = cmdcount + 1
-
-# Look for UDP messages from JS8CALL telling us things.
-def check_messages():
-  global cmdcount, msg
+# Show the bands in the title bar.
+def showband( bands ):
+  global window
+  window.title("JS8 network on {} MHz".format(bands))
 
-  # Look for an incoming UDP message
+# Get the next message waiting in the inbox of the receiver
+# thread, or None if there is nothing to read.
+def next_message():
   try:
-    msg, address = usock.recvfrom(2000)
-  except socket.error:
-    msg = None
+    return inbox.popleft()
+  except IndexError:
+    return None
 
-  if msg:
-    msg = msg.decode('utf-8')
-    data = json.loads(msg)
-    js8 = data['params']
+# Look for UDP messages from JS8CALL telling us things.  This is
+# the 'poll' ingest mode.
+def check_messages():
+  full = False
+  for src in js8ingest.sources:
+    if js8ingest.read_messages( src.next ) >= FLAGS.batch:
+      full = True
 
-    if 'CMD' in js8:
-      do_cmd(js8)
+  # If anything changed in what we know about the network,
+  # redraw the map.
+  draw.repaint()
 
-    # Our own transmissions get counted
-    elif 'TONES' in js8:
-      cmdcount = cmdcount + 1
-      n = 0
+  # Check for more UDP messages twice per second, or right away
+  # if we stopped because the batch was full.
+  if full:
+    window.after( 1, check_messages )
+  else:
+    window.after( 550, check_messages )
 
-    # Watch for band changes
-    elif 'DIAL' in js8:
-      updatefreq( js8 )
+# Tk calls this as soon as a socket has something to read.  This
+# is the 'event' ingest mode.  If more is left after a full batch,
+# Tk will call again right away.
+def on_readable( src ):
+  js8ingest.read_messages( src.next )
+  draw.repaint()
 
-  # If anything changed in what we know about the network,
-  # redraw the map.
+# The 'thread' ingest mode listens to all sources with an asyncio
+# loop in a separate thread, which queues the messages for the
+# Tk thread.  The Tk thread is woken with a virtual event when the
+# inbox was empty.
+def receiver():
+  loop = asyncio.new_event_loop()
+  js8ingest.listen( loop, queue_message )
+  loop.run_forever()
+
+def queue_message( msg, src ):
+  global wakeup
+  inbox.append( (msg, src) )
+  if not wakeup:
+    wakeup = True
+    try:
+      window.event_generate( '<<JS8Message>>', when='tail' )
+    except (RuntimeError, tk.TclError):
+      # Tk is not running yet or is shutting down.  The next
+      # message tries again.
+      wakeup = False
+
+# Handle one batch of the messages the receiver thread queued.  If
+# more are left, come back for them after Tk has had a chance to
+# handle the user, as check_messages() does.
+def on_message_event( ev=None ):
+  global wakeup
+  wakeup = False
+  js8ingest.read_messages( next_message )
   draw.repaint()
+  if inbox and not wakeup:
+    wakeup = True
+    window.after( 1, on_message_event )
 
-  # Check for more UDP messages twice per second
-  window.after( 550, check_messages )
+# Whether the Tcl library was built with thread support.  Tcl 8
+# only sets tcl_platform(threaded) when it was.
+def tcl_threaded():
+  try:
+    return window.tk.eval( 'set tcl_platform(threaded)' ) == '1'
+  except tk.TclError:
+    return False
+
+# Choose how to find out about UDP messages.  'event' needs Tk file
+# handlers, which only exist on Unix, and 'thread' needs a Tcl
+# library built with thread support.  'poll' always works.
+def start_ingest():
+  global ingest
+  ingest = FLAGS.ingest
+  if ingest == 'event' and not hasattr( window.tk, 'createfilehandler' ):
+    ingest = 'thread'
+  if ingest == 'thread' and not tcl_threaded():
+    ingest = 'poll'
+  if FLAGS.debug > 0:
+    print("UDP ingest mode is {}".format(ingest))
+
+  if ingest == 'event':
+    for src in js8ingest.sources:
+      window.tk.createfilehandler( src.sock, tk.READABLE, \
+        lambda f, mask, s=src: on_readable(s) )
+  elif ingest == 'thread':
+    window.bind( '<<JS8Message>>', on_message_event )
+    threading.Thread( target=receiver, daemon=True ).start()
+  else:
+    window.after( 200, check_messages )
 
 ####################
 # Initialization starts here
 ####################
 
-# Set up UDP port for listeming to JS8CALL.
-try:
-  usock = socket.socket( socket.AF_INET, socket.SOCK_DGRAM )
-  usock.setblocking(False)
-  usock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-  usock.bind( ('', FLAGS.port) )
-except socket.error as msg:
-  print("Socket error %s\n" % msg[1] )
+# Set up UDP ports for listeming to JS8CALL.
+js8ingest.open_sources( FLAGS.ports )
 
 # Set up a display window.  This has to be done before the
 # font functions will work.
@@ -338,13 +314,17 @@ else:
   showIconsFlag.set(0)  
 showHistoryFlag = tk.IntVar()
 showHistoryFlag.set(0)
+showHoverFlag = tk.IntVar()
+showHoverFlag.set(0)
+showWaterfallFlag = tk.IntVar()
+showWaterfallFlag.set(0)
 lockedFlag = tk.BooleanVar()
 lockedFlag.set(FLAGS.lock)
 
 # Initialize subsystems
 explore.start( window, FLAGS )
 draw.start( window, FLAGS, lockedFlag )
-sta.start( FLAGS )
+sta.start( FLAGS, draw )
 
 # Bind user keystroke inputs to functions.
 window.bind( '<Left>', panleft )
@@ -356,6 +336,9 @@ window.bind( '+', zoomin )
 window.bind( 'd', dump )
 window.bind( 'h', toggleHistory )
 window.bind( 'i', toggleIcons )
+window.bind( 't', toggleHover )
+window.bind( 's', showStats )
+window.bind( 'w', toggleWaterfall )
 window.bind( '<Control-q>', manual_quit )
 
 # Create menus
@@ -381,10 +364,20 @@ viewmenu.add_checkbutton( label="Show history", command=toggleHistory, \
                           font=menufont, accelerator='h', \
                           variable=showHistoryFlag, \
                           offvalue=0, onvalue=1)
+viewmenu.add_checkbutton( label="Hover info", command=toggleHover, \
+                          font=menufont, accelerator='t', \
+                          variable=showHoverFlag, \
+                          offvalue=0, onvalue=1)
 viewmenu.add_checkbutton( label="Lock zoom", \
                           font=menufont, accelerator='z', \
                           variable=lockedFlag, \
                           offvalue=False, onvalue=True)
+viewmenu.add_checkbutton( label="Band activity", command=toggleWaterfall, \
+                          font=menufont, accelerator='w', \
+                          variable=showWaterfallFlag, \
+                          offvalue=0, onvalue=1)
+viewmenu.add_command( label="Statistics", command=showStats, \
+                      font=menufont, accelerator='s')
 menubar.add_cascade( label='View', menu=viewmenu, font=menufont )
 
 # A list of available background maps.
@@ -409,12 +402,17 @@ else:
   else:
     draw.setzoom( None )
 
+# Load historical data before any message is read, so that
+# stations heard first are matched with what the callbook knows.
+sta.load()
+
 # Schedule some events to happen later.  Some will reschedule
 # themselves again.  Times are in milliseconds.
-window.after( 200, check_messages )   # Check for UDP events
-window.after( measurement_interval, measure)  # Compute statistics
-window.after( link_interval, check_links )  # Detect dead links
-window.after( 150, sta.load )         # Load historical data
+js8ingest.start( FLAGS, window, draw, showband )  # Statistics and links
+start_ingest()                        # Check for UDP events
+if FLAGS.metrics_port:
+  import js8metrics
+  js8metrics.start( FLAGS, window )   # Health for monitoring
 
 # Everything else happens in the scheduled events.  'mainloop'
 # will return when the user closes the window.
@@ -426,6 +424,4 @@ except KeyboardInterrupt:
 # At exit, list those stations that were heard about
 # during this session but for which we do not know
 # the grid coordinates.
-for s in sta.Station.book.values():
-  if s.reported and not s.grid:
-    print("  Missing grid for {}".format(s.call))
+sta.missing()
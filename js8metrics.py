@@ -0,0 +1,174 @@
+# JS8METRICS: Report the health of JS8MAP over HTTP
+'''
+    This module is part of JS8MAP.  With the --metrics_port option,
+    it serves the state of JS8MAP in the Prometheus text format, so
+    that a station left running for days can be watched and graphed:
+
+        curl http://localhost:9842/metrics
+
+    The page is put together every few seconds on the main thread,
+    where the stations and links are safe to look at.  The HTTP
+    server runs in a thread of its own and only hands out the latest
+    page, so a slow or stuck client never holds up the map.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import js8ingest
+import js8station as sta
+import js8stats as stats
+
+FLAGS = None
+window = None
+server = None
+page = b''                 # The latest metrics, ready to send
+refresh_interval = 5000    # Milliseconds between updates of 'page'
+
+statenames = {sta.sUNHEARD: 'unheard', sta.sRECENT: 'recent',
+              sta.sFADING: 'fading', sta.sLOCAL: 'local'}
+
+#### Answers every GET with the latest page.
+class Handler(BaseHTTPRequestHandler):
+
+  def do_GET(self):
+    if self.path.split('?')[0] not in ('/', '/metrics'):
+      self.send_error( 404 )
+      return
+    body = page
+    self.send_response( 200 )
+    self.send_header( 'Content-Type', 'text/plain; version=0.0.4; charset=utf-8' )
+    self.send_header( 'Content-Length', str(len(body)) )
+    self.end_headers()
+    self.wfile.write( body )
+
+  def log_message(self, format, *args):
+    if FLAGS.debug > 2:
+      BaseHTTPRequestHandler.log_message( self, format, *args )
+
+# Start serving metrics on FLAGS.metrics_port.  'w' is anything
+# with a tkinter-style after() method.
+def start( fl, w ):
+  global FLAGS, window, server
+  FLAGS = fl
+  window = w
+  try:
+    server = HTTPServer( ('127.0.0.1', FLAGS.metrics_port), Handler )
+  except OSError as e:
+    print("Unable to serve metrics on port {}: {}".format(
+      FLAGS.metrics_port, e))
+    return
+  server.daemon_threads = True
+  threading.Thread( target=server.serve_forever, daemon=True ).start()
+  if FLAGS.debug > 0:
+    print("Serving metrics on http://localhost:{}/metrics".format(
+      FLAGS.metrics_port))
+  refresh()
+
+# Put the page together again.
+def refresh():
+  global page
+  page = '\n'.join( lines() ).encode() + b'\n'
+  window.after( refresh_interval, refresh )
+
+# Quote a label value.
+def label( v ):
+  return '"{}"'.format( str(v).replace( '\\', '\\\\' ).replace(
+    '"', '\\"' ).replace( '\n', '\\n' ))
+
+# Add one metric, with its help and type lines, to 'out'.  'values'
+# is a list of (labels, value) where labels is a string such as
+# '{cmd="SNR"}' or ''.
+def metric( out, name, kind, text, values ):
+  out.append( '# HELP {} {}'.format( name, text ))
+  out.append( '# TYPE {} {}'.format( name, kind ))
+  for labels, v in values:
+    out.append( '{}{} {}'.format( name, labels, v ))
+
+# Messages the kernel threw away because JS8MAP did not read them in
+# time, by local UDP port.  Only Linux reports this.
+def socket_drops():
+  drops = {}
+  try:
+    with open( '/proc/net/udp' ) as f:
+      next( f )
+      for line in f:
+        fields = line.split()
+        port = int( fields[1].split(':')[1], 16 )
+        drops[port] = drops.get( port, 0 ) + int( fields[-1] )
+  except (OSError, ValueError, IndexError, StopIteration):
+    pass
+  return drops
+
+# All the metrics as lines of text.
+def lines():
+  out = []
+  metric( out, 'js8map_congestion', 'gauge',
+    'Messages per hour over a sliding 10 minute window, updated every 5 s',
+    [('', js8ingest.congestion)] )
+  metric( out, 'js8map_messages_received_total', 'counter',
+    'UDP messages read from JS8CALL',
+    [('{{port={}}}'.format( label(src.port) ), src.received)
+     for src in js8ingest.sources] )
+  metric( out, 'js8map_messages_processed_total', 'counter',
+    'UDP messages handled', [('', js8ingest.processed)] )
+  metric( out, 'js8map_messages_dropped_total', 'counter',
+    'UDP messages that could not be understood',
+    [('', js8ingest.dropped)] )
+  drops = socket_drops()
+  if drops:
+    metric( out, 'js8map_socket_drops_total', 'counter',
+      'UDP messages lost because the socket buffer was full',
+      [('{{port={}}}'.format( label(src.port) ), drops.get( src.port, 0 ))
+       for src in js8ingest.sources] )
+
+  cmds = [('{{cmd={}}}'.format( label(n or '(none)') ), count)
+          for n, (count, secs) in sorted( js8ingest.cmdstats.items() )]
+  cmds.append( ('{cmd="(other)"}', js8ingest.othercount) )
+  metric( out, 'js8map_commands_total', 'counter',
+    'JS8CALL commands handled, by command', cmds )
+
+  states = dict.fromkeys( statenames.values(), 0 )
+  for s in sta.Station.book.values():
+    states[statenames.get( s.state, 'unheard' )] += 1
+  metric( out, 'js8map_stations', 'gauge', 'Stations by state',
+    [('{{state={}}}'.format( label(n) ), v) for n, v in states.items()] )
+  metric( out, 'js8map_links', 'gauge',
+    'Links between stations seen recently', [('', len(sta.linkgraph))] )
+  metric( out, 'js8map_hears', 'gauge',
+    'Stations reported as heard by other stations',
+    [('', len(sta.hearsgraph))] )
+  metric( out, 'js8map_callbook_stations', 'gauge',
+    'Stations in the callbook', [('', sta.booksize())] )
+  metric( out, 'js8map_callbook_pending', 'gauge',
+    'Callbook changes waiting to be written', [('', sta.pending())] )
+
+  # Each timed function as a histogram of how long its calls took.
+  out.append( '# HELP js8map_call_seconds Time spent in each timed function' )
+  out.append( '# TYPE js8map_call_seconds histogram' )
+  for name, t in sorted( stats.timers.items() ):
+    func = label( name )
+    n = 0
+    for le, c in zip( stats.buckets, t.hist ):
+      n += c
+      out.append( 'js8map_call_seconds_bucket{{func={},le="{}"}} {}'.format(
+        func, le, n ))
+    out.append( 'js8map_call_seconds_bucket{{func={},le="+Inf"}} {}'.format(
+      func, t.count ))
+    out.append( 'js8map_call_seconds_sum{{func={}}} {}'.format(
+      func, t.total ))
+    out.append( 'js8map_call_seconds_count{{func={}}} {}'.format(
+      func, t.count ))
+  return out
@@ -0,0 +1,66 @@
+# JS8NULL: Stand-in for the visual map when running without a display
+'''
+    This module is part of JS8MAP.  It provides the same functions
+    as JS8DRAW that the station model calls on, but draws nothing.
+    It is used by the headless mode so that neither tkinter nor PIL
+    needs to be loaded.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import datetime
+from js8grid import grid2coord    # Used by js8station as draw.grid2coord
+
+update_needed = False
+congestion = 0
+resetTime = datetime.datetime.now()
+showHistory = False
+
+def needupdate( why=None, s=None, full=False ):
+  global update_needed
+  update_needed = True
+
+def repaint():
+  global update_needed
+  update_needed = False
+
+def setCongestion( c ):
+  global congestion
+  congestion = c
+
+def setbound( x, y, observeLock=True ):
+  pass
+
+def clearHistory( s=None ):
+  pass
+
+def clearHeard( sids ):
+  pass
+
+def drawlink( sfr, sto ):
+  pass
+
+def removeAction( s ):
+  pass
+
+def removeStation( s ):
+  pass
+
+def actCQ( s ):
+  pass
+
+def actHB( s ):
+  pass
+
+def drawstation( s, doingcrop=False ):
+  pass
@@ -0,0 +1,106 @@
+# JS8PARSE: Turn JS8CALL UDP messages into events
+'''
+    This module is part of JS8MAP.  Each UDP message from JS8CALL is
+    a JSON object.  parse() reads one and returns an Event with the
+    fields JS8MAP uses already converted and the callsigns checked,
+    so nothing downstream has to look at the JSON again.
+
+    The orjson or ujson library is used to read the JSON if one is
+    installed, and the standard json library otherwise.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import re
+import functools
+
+try:
+  import orjson as jsonlib
+  backend = 'orjson'
+except ImportError:
+  try:
+    import ujson as jsonlib
+    backend = 'ujson'
+  except ImportError:
+    import json as jsonlib
+    backend = 'json'
+
+# Kinds of event
+eCMD = 0       # A message between stations
+eTX = 1        # Our own transmission
+eDIAL = 2      # The radio frequency
+eOTHER = 3     # Anything else
+
+callpat = re.compile('^[0-9A-Z/]+$')
+
+# Clean up messy callsigns.  These can result from incorrect
+# decoding of weak signals.  The same few calls turn up over and
+# over, so the answers are remembered.
+@functools.lru_cache( maxsize=4096 )
+def clean( c ):
+  if callpat.match( c ):
+    return c
+  return None
+
+#### One message from JS8CALL.
+class Event:
+
+  __slots__ = ('kind', 'cmd', 'cfr', 'cto', 'snr', 'tdrift', 'offset',
+               'grid', 'words', 'text', 'freq')
+
+  def __init__(self, kind):
+    self.kind = kind
+    self.cmd = None       # JS8 command, such as 'HEARTBEAT'
+    self.cfr = None       # Cleaned callsigns, None if not valid
+    self.cto = None
+    self.snr = None
+    self.tdrift = None
+    self.offset = None
+    self.grid = None      # Grid sent with the message, maybe ''
+    self.words = None     # Words of the message after the command
+    self.text = None      # The same, joined with spaces
+    self.freq = None      # Radio frequency in Hz
+
+# Read one UDP message.  Returns an Event, or None if the message
+# is not something we can understand.
+def parse( msg ):
+  try:
+    js8 = jsonlib.loads( msg )['params']
+    if 'CMD' in js8:
+      ev = Event( eCMD )
+      ev.cmd = js8['CMD'].strip()
+      ev.cfr = clean( js8['FROM'] )
+      ev.cto = clean( js8['TO'] )
+      ev.snr = int( js8['SNR'] )
+      ev.tdrift = float( js8['TDRIFT'] )
+      ev.offset = int( js8['OFFSET'] )
+      ev.grid = js8.get( 'GRID', '' ).strip()
+
+      # The text is 'FROM: TO CMD words... EOT'.  Keep the words,
+      # without the end-of-transmission marker.
+      words = js8['TEXT'].strip().split(' ')[3:]
+      if words:
+        words.pop()
+      ev.words = words
+      ev.text = ' '.join( words )
+    elif 'TONES' in js8:
+      ev = Event( eTX )
+    elif 'DIAL' in js8:
+      ev = Event( eDIAL )
+      ev.freq = js8['FREQ']
+    else:
+      ev = Event( eOTHER )
+  except (ValueError, KeyError, TypeError, AttributeError):
+    return None
+  return ev
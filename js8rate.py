@@ -0,0 +1,145 @@
+# JS8RATE: How busy the band is, over a sliding window
+'''
+    This module is part of JS8MAP.  It keeps a count of the messages
+    heard in each of the last few minutes, one bucket per second, so
+    that the message rate can be read at any moment instead of once
+    at the end of a fixed measurement interval.  The same is done for
+    each station and for each part of the audio passband.
+
+    Adding a message costs the same however busy the band is.  When
+    a bucket falls out of the window, what it held is taken off the
+    running totals, so reading a rate is just as cheap.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import time
+import heapq
+
+window_secs = 10 * 60    # How far back rates look
+shortest = 60            # Seconds to average over at startup
+offset_width = 50        # Hz of audio passband per offset bin
+
+#### Counts of events in the last 'seconds' seconds.  Each event
+#### may carry a key, such as a station ID, and then the count
+#### for that key is kept as well.
+class Window:
+
+  def __init__(self, seconds):
+    self.seconds = seconds
+    self.counts = [0] * seconds      # Events in each second
+    self.keys = [None] * seconds     # {key: events} in each second
+    self.keyed = {}                  # key: events in the window
+    self.total = 0
+    self.now = int( time.monotonic() )
+    self.began = self.now
+
+  # Empty the buckets that have fallen out of the window by 'sec'.
+  def advance(self, sec):
+    if sec <= self.now:
+      return
+    if sec - self.now >= self.seconds:
+      self.counts = [0] * self.seconds
+      self.keys = [None] * self.seconds
+      self.keyed = {}
+      self.total = 0
+    else:
+      for t in range( self.now + 1, sec + 1 ):
+        i = t % self.seconds
+        self.total -= self.counts[i]
+        self.counts[i] = 0
+        old = self.keys[i]
+        if old:
+          for k, n in old.items():
+            left = self.keyed[k] - n
+            if left:
+              self.keyed[k] = left
+            else:
+              del self.keyed[k]
+          self.keys[i] = None
+    self.now = sec
+
+  # Count an event now, or at monotonic time 'when'.  Events from
+  # before the window are ignored.
+  def add(self, key=None, n=1, when=None):
+    if when is None:
+      when = time.monotonic()
+    sec = int( when )
+    self.advance( sec )
+    if sec <= self.now - self.seconds:
+      return
+    i = sec % self.seconds
+    self.counts[i] += n
+    self.total += n
+    if key is not None:
+      d = self.keys[i]
+      if d is None:
+        d = self.keys[i] = {}
+      d[key] = d.get( key, 0 ) + n
+      self.keyed[key] = self.keyed.get( key, 0 ) + n
+
+  # Forget the counts for each key, keeping the total.
+  def forget(self):
+    self.keys = [None] * self.seconds
+    self.keyed = {}
+
+  # Events in the window, for 'key' or for everything.
+  def count(self, key=None):
+    self.advance( int( time.monotonic() ))
+    if key is None:
+      return self.total
+    return self.keyed.get( key, 0 )
+
+  # Events per hour, for 'key' or for everything.  Until the window
+  # has filled, the time so far is used, but at least 'shortest'
+  # seconds so that the first few messages do not look like a flood.
+  def rate(self, key=None):
+    n = self.count( key )
+    span = min( self.seconds, max( shortest, self.now - self.began ))
+    return n * 3600 / span
+
+  # The 'n' keys with the most events, as (key, events) pairs.
+  def busiest(self, n=10):
+    self.advance( int( time.monotonic() ))
+    return heapq.nlargest( n, self.keyed.items(), key=lambda kv: kv[1] )
+
+traffic = Window( window_secs )    # Keyed by station ID
+offsets = Window( window_secs )    # Keyed by offset bin
+
+# Count a message from station ID 'sid', if known, at audio offset
+# 'offset' Hz, if known.
+def heard( sid=None, offset=None ):
+  when = time.monotonic()
+  traffic.add( sid, when=when )
+  if offset is not None:
+    offsets.add( offset // offset_width, when=when )
+
+# Forget the message rates of all stations, as when their IDs are
+# about to be given out again.
+def forget_stations():
+  traffic.forget()
+
+# Messages per hour across the whole band.  This is the 'congestion'
+# level that throttles automatic transmissions.
+def congestion():
+  return int( traffic.rate() )
+
+# Messages per hour from one station.
+def station( sid ):
+  return traffic.rate( sid )
+
+# The busiest parts of the passband as (low Hz, messages per hour).
+def busy_offsets( n=10 ):
+  return [(b * offset_width, offsets.rate( b ))
+          for b, c in offsets.busiest( n )]
@@ -0,0 +1,85 @@
+# JS8REPLAY: Play back recorded JS8CALL traffic
+'''
+    This program is part of JS8MAP.  It sends the UDP messages in a
+    file made with the --capture option back to JS8MAP, as though
+    JS8CALL were sending them, so that a busy band can be reproduced
+    without being on the air.
+
+        python js8replay.py capture.dat
+        python js8replay.py --speed=10 capture.dat
+        python js8replay.py --speed=max --port=2243 capture.dat
+
+    Messages go to the port each was recorded on, unless --port is
+    given.  --speed=1 keeps the original timing, --speed=N plays N
+    times as fast and --speed=max sends everything as fast as it can.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import sys
+import time
+import socket
+import argparse
+import js8capture
+
+def main():
+  p = argparse.ArgumentParser()
+  p.add_argument( 'file', help='Capture file to play back' )
+  p.add_argument( '--host', default='127.0.0.1',
+    help='Where JS8MAP is running' )
+  p.add_argument( '--port', type=int, default=None,
+    help='UDP port to send to, instead of the recorded one' )
+  p.add_argument( '--speed', default='1',
+    help='How many times as fast as recorded, or "max"' )
+  p.add_argument( '--repeat', type=int, default=1,
+    help='Times to play the file' )
+  FLAGS = p.parse_args()
+
+  speed = None
+  if FLAGS.speed != 'max':
+    speed = float( FLAGS.speed )
+    if speed <= 0:
+      print("Speed must be more than zero")
+      return 1
+
+  sock = socket.socket( socket.AF_INET, socket.SOCK_DGRAM )
+  count = 0
+  began = time.monotonic()
+  try:
+    for r in range( FLAGS.repeat ):
+      first = None
+      start = time.monotonic()
+      for when, port, msg in js8capture.read( FLAGS.file ):
+        if first is None:
+          first = when
+        # Wait until this message is due.
+        if speed:
+          delay = start + (when - first) / speed - time.monotonic()
+          if delay > 0:
+            time.sleep( delay )
+        sock.sendto( msg, (FLAGS.host, FLAGS.port or port) )
+        count += 1
+  except KeyboardInterrupt:
+    pass
+  except ValueError as e:
+    print( e )
+    return 1
+
+  took = time.monotonic() - began
+  print("Sent {} messages in {:.1f} seconds, {:.0f} per second".format(
+    count, took, count / max(took, 1e-6)))
+  return 0
+
+if __name__ == '__main__':
+  sys.exit( main() )
@@ -21,7 +21,13 @@ import datetime
 import time
 import re
 import random
-import js8draw as draw
+import atexit
+import js8callbook
+import js8graph
+import js8timer
+import js8rate
+import js8parse
+import js8null as draw
 
 FLAGS = None
 canvas = None
@@ -34,28 +40,33 @@ station_timeout = 60*30*1000
 callbook = {}
 localStation = None
 
+# Who has heard whom during this session, and which stations have
+# exchanged messages within the last 'link_timeout' seconds.  Both
+# are kept by station ID.
+hearsgraph = js8graph.Hears()
+linkgraph = js8graph.Graph( expiring=True )
+linkcheck = None        # When links will next be checked
+
 # Station status
 sUNHEARD = 0
 sRECENT = 1
 sFADING = 2
 sLOCAL = 3
 
-def start( fl ):
-  global FLAGS, link_timeout, station_timeout, callpat, gridpat
+# 'drawer' is the module that puts stations on the map.  Without
+# one, nothing is drawn.
+def start( fl, drawer=None ):
+  global FLAGS, link_timeout, station_timeout, gridpat, draw
   FLAGS = fl
+  if drawer:
+    draw = drawer
   link_timeout = 60 * FLAGS.link_timeout
   station_timeout = 60 * FLAGS.station_timeout
-#  callpat = re.compile('^\\d?[A-Z]+\\d[A-Z]+$')
-  callpat = re.compile('^[0-9A-Z/]+$')
   gridpat = re.compile('^[A-Z]{2}[0-9]{2}$')
 
 # Clean up messy callsigns.  These can result from incorrect
 # decoding of weak signals.
-def clean(c):
-  global callpat
-  if re.match( callpat, c ):
-    return c
-  return None
+clean = js8parse.clean
 
 # Look up a known station given its call, or create a new one.
 # Group names are ignored because they have no geographic location.
@@ -79,28 +90,26 @@ def gotStation(c):
   s = Station(c)
 
   # Have we seen it before?  Can fill in grid if so.
-  if c in callbook:
-    s.setgrid( callbook[c] )
+  grid = callbook.get(c)
+  if grid:
+    s.setgrid( grid, known=grid )
 
   return s
 
-# Load the callbook of previously discovered station
-# locations.  Each line of the file contains a callsign
-# and grid locator.
+# Open the callbook of previously discovered station
+# locations.  Entries are looked up as they are needed rather
+# than read in here.  The text file of older versions, with a
+# callsign and grid locator on each line, is brought in the
+# first time and again whenever it is edited.
 def load():
   global FLAGS, callbook, sLOCAL
+  callbook = js8callbook.Callbook( FLAGS.book, FLAGS.reference )
+  atexit.register( close )
   if os.path.isfile(FLAGS.data):
-    with open(FLAGS.data, "r") as f:
-      d = f.readline()
-      while d:
-        d = d.strip()
-        # Ignore empty and comment lines.
-        if d != '' and d[0] != '#':
-          (c,g) = d.split(',')
-          callbook[c] = g
-        d = f.readline()
-    f.close
-  else:
+    n = callbook.migrate( FLAGS.data )
+    if n and FLAGS.debug > 0:
+      print("Read {} stations from {}".format(n, FLAGS.data))
+  elif FLAGS.debug > 0:
     print("No callbook file {}".format(FLAGS.data))
 
   # Create a Station instance for the local station.
@@ -112,28 +121,100 @@ def load():
     if FLAGS.grid:
       s.setgrid( FLAGS.grid, saveit=0 )
     else:
-      if FLAGS.call in callbook:
-        s.setgrid( callbook[FLAGS.call] )
+      grid = callbook.get(FLAGS.call)
+      if grid:
+        s.setgrid( grid, known=grid )
 
   if FLAGS.debug > 0:
     print("Callbook has {} stations".format(
       len(callbook)))
 
-#### This class represents one station in the network.
+# Write out newly learned station locations.  This happens from
+# time to time and at exit.
+def flush():
+  global FLAGS, callbook
+  if not isinstance( callbook, js8callbook.Callbook ):
+    return
+  n = callbook.flush()
+  if n and FLAGS.debug > 1:
+    print("Saved {} callbook changes".format(n))
+
+# Flush the callbook and close it at exit.
+def close():
+  global callbook
+  if isinstance( callbook, js8callbook.Callbook ):
+    callbook.close()
+    callbook = {}
+
+# How many callbook changes are waiting to be written.
+def pending():
+  global callbook
+  if isinstance( callbook, js8callbook.Callbook ):
+    return len(callbook.pending)
+  return 0
+
+# How many stations the callbook holds, not counting waiting changes.
+def booksize():
+  global callbook
+  if isinstance( callbook, js8callbook.Callbook ):
+    return callbook.saved()
+  return 0
+
+# Forget links that have not been seen for 'link_timeout'
+# seconds.  Only the expired links are looked at.  This runs
+# when the oldest link is due to expire.
+def purgelinks():
+  global link_timeout, FLAGS, linkcheck
+  linkcheck = None
+  gone = linkgraph.expire( time.time() - link_timeout )
+  if FLAGS.debug > 2:
+    for e in gone:
+      print("  Removed link from {} to {}".format(
+        Station.byid[e.sfr].call, Station.byid[e.sto].call))
+  if gone:
+    draw.needupdate('purge links')
+  checklinks()
+
+# Arrange for purgelinks() to run when the oldest link expires.
+def checklinks():
+  global link_timeout, linkcheck
+  if linkcheck is not None or not linkgraph.edges:
+    return
+  oldest = next( iter( linkgraph.edges.values() ))
+  linkcheck = time.monotonic() + oldest.last + link_timeout - time.time()
+  js8timer.at( linkcheck, purgelinks )
+
+# List those stations that were heard about during this session
+# but for which we do not know the grid coordinates.
+def missing():
+  for s in Station.book.values():
+    if s.reported and not s.grid:
+      print("  Missing grid for {}".format(s.call))
+
+#### This class represents one station in the network.  There can
+#### be a great many of them, most only mentioned in HEARING
+#### messages, so each one is kept small.  Stations refer to each
+#### other by an integer ID, an index into Station.byid.
 class Station:
 
+  __slots__ = ('id', 'call', 'heard', 'grid', 'x', 'y',
+               'reported', 'latitude', 'longitude', 'action', 'state',
+               'icon', 'heardme', 'info', 'hasmsg', 'level',
+               'hearshown', 'changed', 'fade')
+
   book = {}    # A dictionary of all known stations, indexed by call.
+  byid = []    # All known stations, indexed by ID.  None if dropped.
 
+  # Draw all stations, or just those in 'some'.  Lines for links
+  # are drawn as messages arrive and follow the map by themselves.
   @classmethod
-  def drawall(self, forcecrop=False):
-    # Draw 'hearing' links underneath.
-    for s1 in Station.book.values():
-      for s2 in s1.links:
-        draw.drawlink( s1, s2 )
-
-    # Now draw the station names on top.  Only the ones
-    # we know the positions of.
-    for s1 in Station.book.values():
+  def drawall(self, forcecrop=False, some=None):
+    if some is None:
+      some = Station.book.values()
+
+    # Draw the station names.  Only the ones we know the
+    # positions of.
+    for s1 in some:
       s1.draw(forcecrop)
 
   # Mark all stations as unheard so they disappear from the map.
@@ -142,12 +223,11 @@ class Station:
   def reset(self):
     global sLOCAL
     us = None
-    self.hears = {}
-    self.hearshown = {}
+    hearsgraph.clear()
+    linkgraph.clear()
 
     for c,s in Station.book.items():
-      s.links = []
-      s.hears = {}
+      s.fade = None
       draw.removeAction( s )
       if s.state != sLOCAL:
         draw.removeStation(s)
@@ -156,15 +236,40 @@ class Station:
 
     del Station.book
     Station.book = {}
+    Station.byid = []
+    js8rate.forget_stations()
     if us:
       Station.book[us.call] = us
+      us.id = 0
+      Station.byid.append( us )
 
     draw.needupdate('reset')
 
+  # Remove some stations from the map, as when one of several
+  # JS8CALL sources changes band.  The local station remains.
+  @classmethod
+  def drop(self, calls):
+    gone = set()
+    for c in calls:
+      s = Station.book.get(c)
+      if s and s.state != sLOCAL:
+        gone.add( s.id )
+        s.fade = None
+        draw.removeAction( s )
+        draw.removeStation( s )
+        draw.clearHistory( s )
+        del Station.book[c]
+        Station.byid[s.id] = None
+
+    draw.clearHeard( gone )
+    hearsgraph.drop( gone )
+    linkgraph.drop( gone )
+    draw.needupdate('drop')
+
   def __init__(self, callsign):
-    self.call = callsign   # Simple callsign
+    self.id = len(Station.byid)
+    self.call = sys.intern(callsign)   # Simple callsign
     self.heard = None      # Time it was last heard from
-    self.links = []        # Other stations is communicating with
     self.grid = None       # Maidenhead coordinates
     self.x = 0             # Screen coorinates
     self.y = 0
@@ -177,20 +282,71 @@ class Station:
     self.heardme = False   # Has this station heard us?
     self.info = None
     self.hasmsg = False
-    self.hears = {}
-    self.hearshown = {}
+    self.level = None      # SNR of the last message heard
+    self.hearshown = None  # History lines drawn, by station ID
     self.changed = True
+    self.fade = None       # When it will turn from RECENT to FADING
 
     # Register any new instance in the dictionary of all such.
-    Station.book[callsign] = self
+    Station.book[self.call] = self
+    Station.byid.append( self )
+    draw.needupdate(None, self)
+
+  # Note that the station has to be drawn again.
+  def touch(self, why=None):
+    self.changed = True
+    draw.needupdate(why, self)
+
+  # We have heard from or about the station just now.  It shows as
+  # RECENT until 'station_timeout' seconds after the last time.
+  def hear(self, when=None):
+    global station_timeout
+    self.heard = when or datetime.datetime.now()
+    self.reported = 1
+    if self.state != sLOCAL:
+      self.state = sRECENT
+      waiting = self.fade is not None
+      self.fade = time.monotonic() + station_timeout
+      if not waiting:
+        js8timer.at( self.fade, self.fadeout )
+    self.touch()
+
+  # The fade timer has run out.  If the station was heard again in
+  # the meantime, wait until its new time.
+  def fadeout(self):
+    if self.fade is None:
+      return
+    if self.fade > time.monotonic():
+      js8timer.at( self.fade, self.fadeout )
+      return
+    self.fade = None
+    if self.state == sRECENT:
+      self.state = sFADING
+      self.touch('faded')
 
   def addhears( self, c2 ):
-    if c2.call not in self.hears:
-      self.hears[ c2.call ] = c2
+    self.addHeard( c2 )
+
+  # The stations with the given IDs, skipping any that have been
+  # dropped.
+  @staticmethod
+  def stations( ids ):
+    if not ids:
+      return []
+    byid = Station.byid
+    return [byid[i] for i in ids if byid[i]]
+
+  # The stations this one has heard.
+  def hearing( self ):
+    return Station.stations( hearsgraph.targets( self.id ))
+
+  # The stations this one is communicating with.
+  def linked( self ):
+    return Station.stations( linkgraph.targets( self.id ))
 
   # A station has announced its location.  This is important but
   # rare information so we remember it.
-  def setgrid( self, loc, saveit=1 ):
+  def setgrid( self, loc, saveit=1, known=None ):
     global FLAGS, gridpat, callbook
     if loc == '':
       return
@@ -205,35 +361,29 @@ class Station:
     if not re.match( gridpat, loc ):
       return
 
-    # It has the proper form, so we process it.
-    self.changed = True
-
-    # Has he moved?
-    if self.call in callbook:
-      oldloc = callbook[self.call]
+    # It has the proper form, so we process it.  Has he moved?
+    # 'known' is the callbook's grid if the caller looked it up.
+    oldloc = known if known is not None else callbook.get(self.call)
+    if oldloc:
       if oldloc != loc:
-        # Announce the move.  We need a better way to remember this.
+        # Announce the move.  The callbook entry is replaced below.
         print("{} has moved from {} to {}".format( \
           self.call, oldloc, loc ))
-        # We delete the old entry so the code below will treat it
-        # like new information.
-        del callbook[self.call]
     else:
       # Not in callbook so this is new information.
       if FLAGS.debug > 1:
-        print('{} reports being at "{}"'.format(cfr,loc))
+        print('{} reports being at "{}"'.format(self.call,loc))
 
     # Remember the grid as well as map coorindates
     self.longitude, self.latitude = draw.grid2coord(loc)
-    self.grid = loc
+    self.grid = sys.intern(loc)
 
     # Give the map a chance to rezoom.
     draw.setbound(self.longitude, self.latitude)
-    draw.needupdate('set grid')
+    self.touch('set grid')
 
     # Remember this for the future.
-    if saveit and self.call not in callbook:
-      callbook[self.call] = loc
+    if saveit and oldloc != loc:
       self.save()
 
   # Reveal everything we know about a station.
@@ -249,9 +399,7 @@ class Station:
       self.call, self.grid, flags, sname ))
 
     # The list of other stations heard by this one.
-    names = []
-    for ocall in self.hears:
-      names.append( ocall )
+    names = [other.call for other in self.hearing()]
     if len(names) > 0:
       print("   Hears {}".format(' '.join(names)))
 
@@ -261,54 +409,45 @@ class Station:
   def HB( self ):
     draw.actHB(self)
 
+  # Note that this station has heard 'other'.
   def addHeard( self, other ):
     if other:
-      if other.call not in self.hears:
+      if hearsgraph.add( self.id, other.id ):
         if FLAGS.debug > 2:
           print("  {} heard {}".format( self.call, other.call ))
-        self.hears[ other.call ] = other
         if other.state == sLOCAL:
           self.heardme = True
-          self.changed = True
+          self.touch()
     
   # A station has reported all it can hear with a HEARING message.
   # We can discover new stations that we can not hear ourselves.
-  # 'others' is a list of callsigns.
+  # 'others' is a list of callsigns.  Returns the stations that
+  # were real callsigns.
   def sethears(self, others):
+    heard = []
     for c in others:
       nice = clean(c)
       if nice:
         s2 = gotStation(nice)
         self.addHeard( s2 )
-    draw.needupdate('set links for {}'.format(self.call))
+        heard.append( s2 )
+    draw.needupdate('set links', self)
+    return heard
 
   def save(self):
-    global FLAGS
+    global FLAGS, callbook
     if FLAGS.debug > 1:
       print("Saving {} at {}".format(self.call, self.grid))
-    with open(FLAGS.data, "a+") as f:
-      f.write("{},{}\n".format(self.call, self.grid))
+    callbook[self.call] = self.grid
 
-  def link(self, other):
+  # This station has sent a message to 'other'.
+  def link(self, other, snr=None, kind=None):
+    if other:
+      linkgraph.add( self.id, other.id, snr, kind )
+      checklinks()
     self.addHeard( other )
     draw.drawlink( self, other )
 
-  def purgelinks( self ):
-    global link_timeout, FLAGS
-    since = self.age()
-    if not since or since < link_timeout:
-      return
-    if FLAGS.debug > 3:
-      print("Checking links from {}".format(self.call))
-    for other in self.links:
-      since = other.age()
-      if not since or since > link_timeout:
-        self.links.remove( other )
-        if FLAGS.debug > 2:
-          print("  Removed link from {} to {}".format(
-            self.call, other.call))
-        draw.needupdate('purge links for {}'.format(self.call))
-
   def age(self):
     if self.heard:
       now = datetime.datetime.now()
@@ -316,24 +455,12 @@ class Station:
     else:
       return None
 
-  # Put a represenation of the station onto the map.
+  # Put a represenation of the station onto the map.  Its color
+  # depends on how recently we heard from it, which hear() and
+  # fadeout() keep track of.
   def draw(self, forcecrop=False):
-    global local, station_timeout, FLAGS, callfont
-    global sLOCAL, sRECENT, sUNHEARD, sFADING
-
     # We can't draw it if we do not know where it is.
     if not self.grid:
       return
 
-    # Display color depends on how recently we heard from it.
-    if self.state != sLOCAL:     # We never change
-      if self.reported:
-        recent = self.age()
-        if recent < station_timeout:  # It is recent
-          self.state = sRECENT
-        else:
-          self.state = sFADING
-      else:
-        self.state = sUNHEARD
-
     draw.drawstation( self, forcecrop )
@@ -0,0 +1,120 @@
+# JS8STATS: Count and time what JS8MAP spends its time on
+'''
+    This module is part of JS8MAP.  Functions on the busy paths are
+    wrapped with timed(), which keeps a count and the total and
+    longest time of their calls.  Other events are tallied with
+    count().  report() lists everything, for the statistics panel
+    and the debug output.
+
+    With the --profile option, the whole program is also run under
+    cProfile and the results are written to a file every minute and
+    at exit, to be read with the pstats module.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import time
+import atexit
+import bisect
+import functools
+
+FLAGS = None
+window = None
+timers = {}        # name: Timer
+counters = {}      # name: count
+profiler = None
+profile_interval = 60 * 1000
+started = time.monotonic()
+
+# Upper limits in seconds of the latency histogram buckets.
+buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+           0.5, 1.0, 2.5)
+
+#### The calls made to one timed function.  'hist' counts the calls
+#### that took no longer than each of the 'buckets', and then those
+#### that took longer than all of them.
+class Timer:
+
+  __slots__ = ('count', 'total', 'worst', 'hist')
+
+  def __init__(self):
+    self.count = 0
+    self.total = 0.0
+    self.worst = 0.0
+    self.hist = [0] * (len(buckets) + 1)
+
+  def add(self, secs):
+    self.count += 1
+    self.total += secs
+    if secs > self.worst:
+      self.worst = secs
+    self.hist[bisect.bisect_left( buckets, secs )] += 1
+
+# Wrap a function so that its calls are timed under 'name'.
+def timed( name ):
+  def wrap( func ):
+    t = timers.setdefault( name, Timer() )
+    @functools.wraps( func )
+    def timedfunc( *args, **kwargs ):
+      start = time.perf_counter()
+      try:
+        return func( *args, **kwargs )
+      finally:
+        t.add( time.perf_counter() - start )
+    return timedfunc
+  return wrap
+
+# Add to the count of something that happened.
+def count( name, n=1 ):
+  counters[name] = counters.get( name, 0 ) + n
+
+# A list of lines describing everything measured so far.
+def report():
+  up = time.monotonic() - started
+  lines = ["Running {}:{:02d}".format( int(up / 3600), int(up / 60) % 60 )]
+  lines.append( "{:<16} {:>8} {:>10} {:>10} {:>8}".format(
+    'timer', 'calls', 'mean us', 'worst us', '% time' ))
+  for name, t in sorted( timers.items() ):
+    if t.count:
+      lines.append( "{:<16} {:>8} {:>10.0f} {:>10.0f} {:>8.2f}".format(
+        name, t.count, t.total * 1e6 / t.count, t.worst * 1e6,
+        100 * t.total / up ))
+  for name, n in sorted( counters.items() ):
+    lines.append( "{:<16} {:>8}".format( name, n ))
+  return lines
+
+# Set up profiling if it was asked for.
+def start( fl, w ):
+  global FLAGS, window, profiler
+  FLAGS = fl
+  window = w
+  if FLAGS.profile:
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    atexit.register( dump )
+    window.after( profile_interval, dump_again )
+    if FLAGS.debug > 0:
+      print("Writing profile to {}".format(FLAGS.profile))
+
+# Write the profile so far.  Writing stops the profiler, so it is
+# started again afterwards.
+def dump():
+  if profiler:
+    profiler.dump_stats( FLAGS.profile )
+    profiler.enable()
+
+def dump_again():
+  dump()
+  window.after( profile_interval, dump_again )
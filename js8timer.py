@@ -0,0 +1,77 @@
+# JS8TIMER: Run things at given times
+'''
+    This module is part of JS8MAP.  It keeps a heap of jobs to be
+    done at given times, such as a station fading or a link expiring,
+    and has the event loop wake up only when the earliest one is due.
+    Nothing is looked at until its time comes, however many jobs are
+    waiting.
+
+    Times are from time.monotonic(), in seconds.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import time
+import heapq
+import itertools
+
+window = None      # Anything with a tkinter-style after() method
+heap = []          # (time, sequence, function, arguments)
+sequence = itertools.count()   # Keeps jobs due at once in order
+armed = None       # When the event loop will next wake us
+
+# Jobs can be added before this, and wait until it is called.
+def start( w ):
+  global window
+  window = w
+  arm()
+
+# Call 'func' with 'args' at time 'when'.
+def at( when, func, *args ):
+  heapq.heappush( heap, (when, next(sequence), func, args) )
+  if armed is None or when < armed:
+    arm()
+
+# Call 'func' with 'args' after 'delay' seconds.
+def after( delay, func, *args ):
+  at( time.monotonic() + delay, func, *args )
+
+# Have the event loop wake us for the earliest job.  A wakeup that
+# was asked for earlier and is no longer needed is ignored when it
+# comes.
+def arm():
+  global armed
+  if not window or not heap:
+    return
+  when = heap[0][0]
+  if armed is not None and armed <= when:
+    return
+  armed = when
+  delay = max( 0, int( (when - time.monotonic()) * 1000 ) + 1 )
+  window.after( delay, fire, when )
+
+# Run every job that is due, then wait for the next one.
+def fire( when ):
+  global armed
+  if when != armed:
+    return
+  armed = None
+  now = time.monotonic()
+  while heap and heap[0][0] <= now:
+    when, n, func, args = heapq.heappop( heap )
+    func( *args )
+  arm()
+
+def pending():
+  return len(heap)
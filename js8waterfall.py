@@ -0,0 +1,149 @@
+# JS8WATERFALL: Which audio offsets have been busy lately
+'''
+    This module is part of JS8MAP.  It keeps a histogram of the
+    messages heard in each part of the audio passband over the last
+    few minutes: one row for each JS8 transmission period and one
+    column for each 50 Hz of offset, which is about the width of a
+    JS8 signal.  Each cell holds how many messages were heard there
+    and the strongest SNR among them.  From this the map can show a
+    small waterfall, and the quietest offsets can be suggested for
+    calling CQ.
+
+    Counting a message touches one cell.  A row is cleared when it
+    comes around again, so the cost does not grow with the traffic.
+    If numpy is installed, the cells are numpy arrays.  Otherwise
+    they are lists, which is a little slower to draw.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import time
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+row_secs = 15        # Seconds per row, one JS8 normal speed period
+rows = 60            # Rows kept, so a quarter of an hour
+bin_width = 50       # Hz of offset per column
+cols = 60            # Columns, so 0 to 3000 Hz
+quiet_low = 500      # Offsets suggested as clear are between these
+quiet_high = 2500
+strong = -10         # SNR of a strong signal
+levels = 4           # Message counts told apart when drawing
+NOSNR = -128         # Peak SNR of a cell with no messages
+
+#### Message counts and peak SNR by time and offset.  Row 'r' holds
+#### the period r, r + rows, r + 2 * rows and so on, counting from
+#### when the monotonic clock started.
+class Waterfall:
+
+  def __init__(self):
+    if numpy:
+      self.count = numpy.zeros( (rows, cols), numpy.uint32 )
+      self.peak = numpy.full( (rows, cols), NOSNR, numpy.int8 )
+    else:
+      self.count = [[0] * cols for r in range(rows)]
+      self.peak = [[NOSNR] * cols for r in range(rows)]
+    self.now = int( time.monotonic() / row_secs )
+
+  # Clear the rows for periods since the last message, up to
+  # period 'p'.
+  def advance(self, p):
+    if p <= self.now:
+      return
+    for q in range( max( self.now + 1, p - rows + 1 ), p + 1 ):
+      r = q % rows
+      if numpy:
+        self.count[r] = 0
+        self.peak[r] = NOSNR
+      else:
+        self.count[r] = [0] * cols
+        self.peak[r] = [NOSNR] * cols
+    self.now = p
+
+  # Count a message at 'offset' Hz with signal strength 'snr'.
+  def add(self, offset, snr=None, when=None):
+    if when is None:
+      when = time.monotonic()
+    c = int( offset ) // bin_width
+    if c < 0 or c >= cols:
+      return
+    p = int( when / row_secs )
+    self.advance( p )
+    if p <= self.now - rows:
+      return
+    r = p % rows
+    if numpy:
+      self.count[r, c] += 1
+      if snr is not None and snr > self.peak[r, c]:
+        self.peak[r, c] = max( -127, min( 127, int(snr) ))
+    else:
+      self.count[r][c] += 1
+      if snr is not None and snr > self.peak[r][c]:
+        self.peak[r][c] = max( -127, min( 127, int(snr) ))
+
+  # The row numbers from the newest period to the oldest.
+  def order(self):
+    self.advance( int( time.monotonic() / row_secs ))
+    return [(self.now - k) % rows for k in range(rows)]
+
+  # The histogram to draw, as 'rows' rows of 'cols' bytes with the
+  # newest period first.  Each byte is 0 for no messages, up to
+  # 'levels' for more messages, with 'levels' added for a strong
+  # signal.
+  def image(self):
+    order = self.order()
+    if numpy:
+      count = self.count[order]
+      lvl = numpy.minimum( count, levels ).astype( numpy.uint8 )
+      lvl[(self.peak[order] >= strong) & (count > 0)] += levels
+      return lvl.tobytes()
+    out = bytearray()
+    for r in order:
+      for n, snr in zip( self.count[r], self.peak[r] ):
+        lvl = min( n, levels )
+        if n and snr >= strong:
+          lvl += levels
+        out.append( lvl )
+    return bytes( out )
+
+  # Messages heard in each column over all the rows kept.
+  def totals(self):
+    self.advance( int( time.monotonic() / row_secs ))
+    if numpy:
+      return self.count.sum( axis=0 ).tolist()
+    return [sum( col ) for col in zip( *self.count )]
+
+  # The 'n' quietest offsets between 'quiet_low' and 'quiet_high',
+  # in Hz at the middle of each column.  Neighbouring columns are
+  # skipped so that the choices are spread out.
+  def quiet(self, n=3):
+    totals = self.totals()
+    lo = quiet_low // bin_width
+    hi = min( cols, quiet_high // bin_width )
+    picks = []
+    for c in sorted( range( lo, hi ), key=lambda c: (totals[c], c) ):
+      if all( abs(c - p) > 1 for p in picks ):
+        picks.append( c )
+        if len(picks) == n:
+          break
+    return [c * bin_width + bin_width // 2 for c in picks]
+
+activity = Waterfall()
+
+# Count a message heard at 'offset' Hz with signal strength 'snr'.
+def heard( offset, snr=None ):
+  activity.add( offset, snr )
@@ -17,12 +17,16 @@
 '''
 
 import os
+import threading
+from collections import OrderedDict
 from tkinter import *
 from PIL import Image, ImageFont, ImageDraw
 from PIL import ImageTk
 import tkinter as tk
 from tkinter import font
 import js8draw as draw
+from js8grid import ll2grid
+import js8stats as stats
 
 canvas = None
 FLAGS = None
@@ -93,25 +97,216 @@ class MapSpec:
 def mstretch( lat ):
   return math.secant( math.radians(lat) )
 
-# Convert a Latitude and Longitude to a grid coordinate.
-def ll2grid(lng, lat):
-  # Correct origins
-  lat1=lat+90
-  lng1=lng+180
-  # Scale to A-R in 18 steps.  360/18 = 20 and 180/18 = 10.
-  lnga = lng1/20
-  latb = lat1/10
-  # Split high and low order
-  lnga1 = int(lnga)
-  lngc1 = int((lnga - lnga1)*10)
-  latb1 = int(latb)
-  latd1 = int((latb - latb1)*10)
-  # High order becomes letters, lo order becomes digits
-  a = chr(65+lnga1)
-  b = chr(65+latb1)
-  c = chr(48+lngc1)
-  d = chr(48+latd1)
-  return a + b + c + d
+# This class represents a pyramid of tiles made from one map image.
+# Level 0 is the image at full size and each level above it is half
+# the size of the one below.  Tiles are kept on disk so the image
+# only has to be scaled once, and recently used tiles are kept in
+# memory.  A view of the map is put together from the tiles of the
+# smallest level that still has enough detail for the canvas.
+#
+# Making the tiles means decoding the whole image, which is slow for
+# big maps, so it happens in a background thread.  The smallest
+# level is available first to show in the meantime.
+class TilePyramid:
+
+  tilesize = 256       # Pixels on a side of each tile
+  cachesize = 64       # Tiles kept in memory, for all maps
+  cache = OrderedDict()   # (file, level, column, row): tile image
+  pyramids = {}        # Map file name: its TilePyramid
+  lock = threading.Lock()
+
+  # Get the pyramid for a map file, making a new one if needed.
+  @classmethod
+  def get( self, fullname, filename ):
+    p = TilePyramid.pyramids.get( filename )
+    if not p:
+      # Opening the image only reads its size, not the pixels.
+      raw = Image.open( fullname )
+      p = TilePyramid( fullname, filename, raw.width, raw.height )
+      TilePyramid.pyramids[filename] = p
+    return p
+
+  def __init__(self, fullname, filename, width, height):
+    self.fullname = fullname
+    self.filename = filename
+    self.width = width
+    self.height = height
+    self.dir = MapSpec.mapdir + 'tiles/' + filename + '/'
+    self.thumb = None      # Smallest level, while waiting for tiles
+    self.image = None      # Whole image, only if tiles can't be saved
+    self.started = False   # Tiles are being made
+
+    # Keep halving until the whole image fits in one tile.
+    self.levels = 1
+    while max(width, height) >> (self.levels-1) > self.tilesize:
+      self.levels += 1
+
+    self.ready = self.check()    # Tiles are on disk
+    self.loaded = self.ready     # Nothing more to wait for
+
+  # Make the tiles in a background thread, unless that has
+  # already started.
+  def load(self):
+    if self.claim():
+      threading.Thread( target=self.build, daemon=True ).start()
+
+  # Only one thread may make the tiles.
+  def claim(self):
+    with TilePyramid.lock:
+      if self.loaded or self.started:
+        return False
+      self.started = True
+      return True
+
+  # The tiles on disk are good if they were made from this
+  # version of the map file.
+  def stamp(self):
+    st = os.stat( self.fullname )
+    return "{} {} {}".format( int(st.st_mtime), st.st_size, self.tilesize )
+
+  def check(self):
+    try:
+      with open( self.dir + 'source', "r" ) as f:
+        return f.read().strip() == self.stamp()
+    except OSError:
+      return False
+
+  # Runs in the background thread.  Whatever happens, there is
+  # nothing more to wait for once it is over.
+  def build(self):
+    try:
+      self.make()
+    finally:
+      self.loaded = True
+
+  # Cut up the map file into tiles at each level.  If the tiles can
+  # not be written, the whole image is kept in memory instead.
+  def make(self):
+    global FLAGS
+    if FLAGS.debug > 0:
+      print("Making map tiles for {}".format( self.filename ))
+    shrink = 1 << (self.levels - 1)
+    size = (max(1, self.width // shrink), max(1, self.height // shrink))
+
+    # A JPEG can be decoded at a fraction of its size much faster
+    # than in full, which gives a stand-in to show straight away.
+    # Other formats such as PNG have to be decoded in full, but the
+    # stand-in is then made with a quick box filter, so it is shown
+    # well before the tiles are written.
+    small = Image.open( self.fullname )
+    if small.format == 'JPEG':
+      small.draft( 'RGB', size )
+      self.thumb = small.convert('RGB').resize( size, Image.LANCZOS )
+
+    img = Image.open( self.fullname )
+    if img.mode not in ('RGB', 'L'):
+      img = img.convert('RGB')
+    img.load()
+    if self.thumb is None:
+      self.thumb = img.reduce( shrink )
+    full = img
+    try:
+      for level in range(self.levels):
+        os.makedirs( self.dir + str(level), exist_ok=True )
+        for row in range( 0, img.height, self.tilesize ):
+          for col in range( 0, img.width, self.tilesize ):
+            tile = img.crop( (col, row, \
+              min(col + self.tilesize, img.width), \
+              min(row + self.tilesize, img.height)) )
+            tile.save( self.tilename( level, \
+              col // self.tilesize, row // self.tilesize ))
+        img = img.resize( ((img.width + 1) // 2, (img.height + 1) // 2), \
+          Image.LANCZOS )
+      with open( self.dir + 'source', "w" ) as f:
+        f.write( self.stamp() + "\n" )
+      self.ready = True
+    except OSError as e:
+      print("Unable to make map tiles for {}: {}".format( self.filename, e ))
+      self.image = full
+
+  def tilename(self, level, col, row):
+    return "{}{}/{}_{}.png".format( self.dir, level, col, row )
+
+  # Get one tile, from memory if it has been used recently.
+  def tile(self, level, col, row):
+    key = (self.filename, level, col, row)
+    t = TilePyramid.cache.get( key )
+    if t is not None:
+      TilePyramid.cache.move_to_end( key )
+      return t
+    t = Image.open( self.tilename( level, col, row ))
+    t.load()
+    TilePyramid.cache[key] = t
+    if len(TilePyramid.cache) > self.cachesize:
+      TilePyramid.cache.popitem( last=False )
+    return t
+
+  # Choose the smallest level that still gives at least one
+  # image pixel per canvas pixel over the width 'w' and height
+  # 'h' of the full size image.
+  def choose(self, w, h, cw, ch):
+    level = 0
+    while level + 1 < self.levels and \
+          (w >> (level+1)) >= cw and (h >> (level+1)) >= ch:
+      level += 1
+    return level
+
+  # Put together the part of the image inside 'box', given as
+  # full size pixel coordinates, at one level.  Parts of the box
+  # outside the image are black, as with Image.crop().
+  def region(self, level, box):
+    L, T, R, B = [v >> level for v in box]
+    img = None
+    ts = self.tilesize
+    lw = (self.width + (1 << level) - 1) >> level
+    lh = (self.height + (1 << level) - 1) >> level
+    for row in range( max(0, T // ts), min(B, lh - 1) // ts + 1 ):
+      for col in range( max(0, L // ts), min(R, lw - 1) // ts + 1 ):
+        t = self.tile( level, col, row )
+        if not img:
+          img = Image.new( t.mode, (max(1, R - L), max(1, B - T)) )
+        img.paste( t, (col * ts - L, row * ts - T) )
+    if not img:
+      img = Image.new( 'RGB', (max(1, R - L), max(1, B - T)) )
+    return img
+
+# This class holds recently fitted map images, ready to display,
+# indexed by map file, corners and canvas size.  The oldest are
+# dropped when they take more than FLAGS.map_cache megabytes.
+class FitCache:
+
+  images = OrderedDict()   # key: (image, bytes)
+  size = 0
+
+  @classmethod
+  def get( self, key ):
+    entry = FitCache.images.get( key )
+    if not entry:
+      return None
+    FitCache.images.move_to_end( key )
+    return entry[0]
+
+  @classmethod
+  def put( self, key, image, nbytes ):
+    global FLAGS
+    FitCache.images[key] = (image, nbytes)
+    FitCache.size += nbytes
+    limit = FLAGS.map_cache * 1024 * 1024
+    while FitCache.size > limit and len(FitCache.images) > 1:
+      old, (oldimage, oldbytes) = FitCache.images.popitem( last=False )
+      FitCache.size -= oldbytes
+
+# Make the tiles for all the other maps in the background, so
+# that switching maps later is quick.
+def prefetch():
+  def work():
+    for m in MapSpec.mapfiles:
+      fullname = MapSpec.mapdir + m.filename
+      if os.path.isfile( fullname ):
+        p = TilePyramid.get( fullname, m.filename )
+        if p.claim():
+          p.build()
+  threading.Thread( target=work, daemon=True ).start()
 
 # This class represents the world map background.  Which map is
 # actually used is specified by the user.
@@ -124,24 +319,27 @@ class World:
     canvas = cnv
     FLAGS = flg
     self.map_ll = self.map_ur = None
+    self.bg = None
     self.setmap( FLAGS.map )
 
   # Select a new background map.  We have loaded its specifics
   # from the index.dat file and set up the scaling based on its
-  # actual image size.
-  @classmethod
+  # actual image size.  The image itself is decoded later, in
+  # the background.
   def setmap( self, mnum ):
+    global FLAGS
     self.m = MapSpec.select( mnum )
+    FLAGS.map = mnum
 
     fullname = MapSpec.mapdir + self.m.filename
     if not os.path.isfile( fullname ):
       print("World map file '{}' not found".format( fullname ))
       return None
 
-    # Read the file, and we learn how big it is.
-    self.raw = Image.open( fullname )
-    self.rawx = self.raw.width
-    self.rawy = self.raw.height
+    # Read the file header, and we learn how big it is.
+    self.tiles = TilePyramid.get( fullname, self.m.filename )
+    self.rawx = self.tiles.width
+    self.rawy = self.tiles.height
 
     # We would like the useful width of the map to be 360 degrees
     # and the useful height to be 90 degrees, but sometimes they
@@ -154,15 +352,37 @@ class World:
       (self.m.top_latitude - self.m.bottom_latitude)
 
     self.cropped = None
-    self.fitted = None
-    self.image = None
+    self.box = None
+    self.map_ll = self.map_ur = None
 
     if FLAGS.debug > 3:
       print("New raw map image {} by {}".format( \
            self.rawx, self.rawy ))
 
+    if not self.tiles.loaded:
+      self.tiles.load()
+      canvas.after( 100, self.waitload, self.tiles )
+
     draw.needupdate()
 
+  # Check from time to time whether the background thread has
+  # finished with the map, and show it when it has.  The stand-in
+  # is shown as soon as it is ready.  'thumb' is whether it has
+  # been already.
+  def waitload( self, tiles, thumb=False ):
+    if tiles is not self.tiles:
+      return
+    if not tiles.loaded:
+      if not thumb and tiles.thumb is not None:
+        thumb = True
+        draw.cropneeded = True
+        draw.needupdate( 'map stand-in' )
+      canvas.after( 100, self.waitload, tiles, thumb )
+      return
+    self.map_ll = self.map_ur = None
+    draw.cropneeded = True
+    draw.needupdate( 'map loaded' )
+
   # Select the part of the map to be displayed.  The world
   # coordinates bounding box is converted to pixels within
   # the image.  This can change if the user types +->< or
@@ -188,9 +408,6 @@ class World:
     self.map_ll = ll
     self.map_ur = ur
 
-    if self.cropped:
-        del self.cropped
-
     # Convert longitude degrees to pixels in the image.
     Lx = int((lngmin - self.m.left_longitude) * \
              self.pixlng) + self.m.left_margin
@@ -202,26 +419,64 @@ class World:
     Ty = self.rawy - int((latmax - self.m.bottom_latitude) * \
              self.pixlat) + self.m.top_margin
 
-    # Make a cropped verion
-    # Give coordinates of NW and SE corners.
-    self.cropped = self.raw.crop( (Lx, Ty, Rx, By) )
+    # Give coordinates of NW and SE corners.  The image is not
+    # cropped until fit() finds it is not already in the cache.
+    self.box = (Lx, Ty, Rx, By)
+
+  # Make a cropped verion to fit a canvas of size 'cw' by 'ch'.
+  # Until the map has been loaded, a blurry version is made from
+  # the smallest level of tiles, if even that is ready.
+  def crop( self, cw, ch ):
+    global FLAGS
+    Lx, Ty, Rx, By = self.box
+    t = self.tiles
+    if t.ready:
+      level = t.choose( Rx - Lx, By - Ty, cw, ch )
+      if FLAGS.debug > 3:
+        print("Map from tile level {}".format( level ))
+      self.cropped = t.region( level, self.box )
+    elif t.image is not None:
+      self.cropped = t.image.crop( self.box )
+    elif t.thumb is not None:
+      xs = t.thumb.width / self.rawx
+      ys = t.thumb.height / self.rawy
+      self.cropped = t.thumb.crop( (int(Lx * xs), int(Ty * ys), \
+        max(int(Lx * xs) + 1, int(Rx * xs)), \
+        max(int(Ty * ys) + 1, int(By * ys))) )
+    else:
+      self.cropped = None
+    return self.cropped
 
   # Fit the zoomed image to the current canvas size.  This
-  # can change if the user resizes the main window.
+  # can change if the user resizes the main window.  Recently
+  # fitted images are kept, so going back to an earlier view is
+  # quick.
+  @stats.timed( 'fit' )
   def fit( self):
     global canvas
-    if self.image:
-        canvas.delete(self.bg)
-        del self.bg
-        del self.fitted
-        del self.image
-
-    self.fitted = self.cropped.resize(
-      (canvas.winfo_width(), canvas.winfo_height()),
-      Image.ANTIALIAS)
-
-    self.image = ImageTk.PhotoImage(self.fitted)
-    self.bg = canvas.create_image( 0, 0, image=self.image, anchor=tk.NW )
+    cw = canvas.winfo_width()
+    ch = canvas.winfo_height()
+    key = (self.m.filename, self.map_ll, self.map_ur, cw, ch)
+
+    image = FitCache.get( key )
+    if image is None:
+      # Note whether this is the real map before cropping, as the
+      # background thread may finish in the meantime.  A blurry
+      # stand-in must not be kept in the cache.
+      real = self.tiles.ready or self.tiles.image is not None
+      cropped = self.crop( cw, ch )
+      if cropped is None:
+        return
+      image = ImageTk.PhotoImage( cropped.resize( (cw, ch), Image.LANCZOS ))
+      if real:
+        FitCache.put( key, image, cw * ch * 4 )
+      self.cropped = None
+
+    self.image = image
+    if self.bg:
+      canvas.itemconfigure( self.bg, image=self.image )
+    else:
+      self.bg = canvas.create_image( 0, 0, image=self.image, anchor=tk.NW )
 
     # Make sure the world map stays behind everything else.
     canvas.lower( self.bg )